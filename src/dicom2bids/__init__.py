@@ -2,13 +2,25 @@
 DICOM to BIDS conversion pipeline.
 """
 
+import importlib
+
 from .utils.config import Config, ConfigManager
-from .convert_and_organize import main as convert_main
-from .metadata_enrichment import main as metadata_main
-from .finalize_pipeline import main as finalize_main
 
 __version__ = "0.1.0"
 
+# Stage entry points, imported on first access so that importing the
+# package (e.g. for `dicom2bids --help`) does not load pandas and nibabel
+_LAZY_MAINS = {
+    'convert_main': 'convert_and_organize',
+    'metadata_main': 'metadata_enrichment',
+    'finalize_main': 'finalize_pipeline',
+}
+
+def __getattr__(name):
+    if name in _LAZY_MAINS:
+        return importlib.import_module(f".{_LAZY_MAINS[name]}", __name__).main
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 __all__ = [
     'Config',
     'ConfigManager',
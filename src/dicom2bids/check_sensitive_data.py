@@ -2,42 +2,216 @@
 # check_sensitive_data.py
 
 import os
+import re
 import sys
 import json
+import sqlite3
 import logging
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional, Pattern
+
+try:
+    import ijson  # optional: streams top-level keys without building the whole document
+except ImportError:
+    ijson = None
+
+try:
+    import orjson  # optional: faster validation of prefiltered files
+except ImportError:
+    orjson = None
+
+try:
+    import ahocorasick  # optional: one automaton over all sensitive terms
+except ImportError:
+    ahocorasick = None
+
+# Threads for reading sidecars: I/O bound, so a few more than there are CPUs
+# (the concurrent.futures default for thread pools)
+IO_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# Location used by a bare --cache; the cache is only written when asked for,
+# since it stores the findings (including the sensitive values)
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'dicom2bids', 'sensitive.sqlite')
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
-def check_sensitive_info(json_path: str, sensitive_terms: List[str]) -> List[str]:
+def compile_sensitive_pattern(sensitive_terms: List[str]) -> Pattern[str]:
+    """
+    Compile the sensitive terms into a single case-insensitive alternation.
+    
+    A term matches as a whole word; underscores and other non-alphanumeric
+    characters count as word separators, so 'patient' matches 'patient_id'.
+    
+    Parameters:
+    sensitive_terms (List[str]): List of sensitive terms to check for
+    
+    Returns:
+    Pattern[str]: Compiled regular expression
+    """
+    alternation = '|'.join(re.escape(term) for term in sensitive_terms)
+    return re.compile(rf'(?<![A-Za-z0-9])(?:{alternation})(?![A-Za-z0-9])', re.IGNORECASE)
+
+def build_term_matcher(sensitive_terms: List[str]) -> Callable[[str], List[str]]:
+    """
+    Build a function returning the (lowercase) sensitive terms found in a key.
+    
+    Uses a single Aho-Corasick automaton over all terms when pyahocorasick is
+    installed, and one compiled pattern per term otherwise (an alternation
+    would miss overlapping terms such as 'name' inside 'first name'). Both
+    apply the same whole-word rule as compile_sensitive_pattern and return
+    the same terms in the same order: by position, then alphabetically.
+    
+    Parameters:
+    sensitive_terms (List[str]): List of sensitive terms to check for
+    
+    Returns:
+    Callable[[str], List[str]]: Matcher returning each matched term once, in order
+    """
+    if ahocorasick is None:
+        patterns = [(term.lower(), compile_sensitive_pattern([term])) for term in dict.fromkeys(sensitive_terms)]
+        
+        def match_terms_regex(key: str) -> List[str]:
+            matched = sorted((m.start(), term) for term, pattern in patterns for m in pattern.finditer(key))
+            return list(dict.fromkeys(term for _, term in matched))
+        
+        return match_terms_regex
+    
+    automaton = ahocorasick.Automaton()
+    for term in sensitive_terms:
+        automaton.add_word(term.lower(), term.lower())
+    automaton.make_automaton()
+    
+    def match_terms(key: str) -> List[str]:
+        key_lower = key.lower()
+        matched = {}
+        for end, term in automaton.iter(key_lower):
+            start = end - len(term) + 1
+            before = key_lower[start - 1] if start > 0 else ''
+            after = key_lower[end + 1] if end + 1 < len(key_lower) else ''
+            if not (before.isascii() and before.isalnum()) and not (after.isascii() and after.isalnum()):
+                matched[(start, term)] = term
+        return list(dict.fromkeys(term for _, term in sorted(matched)))
+    
+    return match_terms
+
+def build_byte_prefilter(sensitive_terms: List[str]) -> Optional[Callable[[bytes], bool]]:
+    """
+    Build a cheap test of whether a file's raw bytes could contain any term.
+    
+    A file whose bytes contain none of the terms (ASCII case-insensitively)
+    cannot produce a finding, so it does not need to be parsed. The terms are
+    found in a single pass: one compiled bytes alternation, or an Aho-Corasick
+    automaton over the lowercased bytes when pyahocorasick is installed. JSON
+    \\u escapes can spell a key without its literal bytes, so files containing
+    one are always passed through.
+    
+    Parameters:
+    sensitive_terms (List[str]): List of sensitive terms to check for
+    
+    Returns:
+    Optional[Callable[[bytes], bool]]: Prefilter, or None when a term is not
+    ASCII and bytes-level case folding would not match str.lower
+    """
+    if not all(term.isascii() for term in sensitive_terms):
+        return None
+    
+    if ahocorasick is None:
+        pattern = re.compile(b'|'.join(re.escape(term.encode()) for term in sensitive_terms), re.IGNORECASE)
+        return lambda blob: b'\\u' in blob or pattern.search(blob) is not None
+    
+    automaton = ahocorasick.Automaton()
+    for term in sensitive_terms:
+        automaton.add_word(term.lower(), term.lower())
+    automaton.make_automaton()
+    
+    def may_match(blob: bytes) -> bool:
+        if b'\\u' in blob:
+            return True
+        # The automaton works on str; latin-1 maps each byte to one character
+        return next(automaton.iter(blob.lower().decode('latin-1')), None) is not None
+    
+    return may_match
+
+def is_json_object(blob: bytes) -> bool:
+    """
+    Check that raw bytes parse as a JSON object.
+    
+    Parameters:
+    blob (bytes): File contents
+    
+    Returns:
+    bool: True if `blob` is a valid JSON document whose top level is an object
+    """
+    try:
+        data = orjson.loads(blob) if orjson is not None else json.loads(blob)
+    except ValueError:
+        return False
+    return isinstance(data, dict)
+
+def iter_top_level_items(json_path: str):
+    """
+    Yield the top-level (key, value) pairs of a JSON object.
+    
+    Uses ijson's C-backed parser when it is installed and falls back to
+    json.load otherwise, or if that parse fails or the document is not an
+    object. Numbers are parsed as floats and duplicate keys keep the last
+    value, so the pairs (and any error) are the same as from json.load.
+    
+    Parameters:
+    json_path (str): Path to the JSON file
+    
+    Returns:
+    Iterator[Tuple[str, Any]]: Top-level key/value pairs
+    """
+    if ijson is not None:
+        try:
+            with open(json_path, 'rb') as f:
+                if not f.read(4096).lstrip().startswith(b'{'):
+                    raise ValueError("top level is not an object")
+                f.seek(0)
+                data = dict(ijson.kvitems(f, '', use_float=True))
+            yield from data.items()
+            return
+        except Exception as e:
+            logger.debug(f"Streaming parse failed for {json_path}, using json.load: {e}")
+    
+    with open(json_path) as f:
+        data = json.load(f)
+    yield from data.items()
+
+def check_sensitive_info(json_path: str, match_terms: Callable[[str], List[str]],
+                         may_match: Optional[Callable[[bytes], bool]] = None) -> List[str]:
     """
     Check a JSON file for sensitive information.
     
     Parameters:
     json_path (str): Path to the JSON file
-    sensitive_terms (List[str]): List of sensitive terms to check for
+    match_terms (Callable[[str], List[str]]): Matcher from build_term_matcher
+    may_match (Optional[Callable[[bytes], bool]]): Prefilter from build_byte_prefilter;
+        a file it rejects skips the term scan once it is confirmed to be a
+        valid JSON object, so malformed files are still reported
     
     Returns:
     List[str]: List of findings (empty if no sensitive info found)
     """
     findings = []
     try:
-        with open(json_path) as f:
-            data = json.load(f)
-        
-        for key in data.keys():
-            # Convert key to lowercase for case-insensitive comparison
-            key_lower = key.lower()
-            for term in sensitive_terms:
-                # Check if the term is a whole word using word boundaries
-                if f" {term} " in f" {key_lower} ":
-                    findings.append(f"\nFound sensitive term '{term}' in {json_path}")
-                    findings.append(f"Key: {key}")
-                    findings.append(f"Value: {data[key]}")
+        if may_match is not None:
+            with open(json_path, 'rb') as f:
+                blob = f.read()
+            if not may_match(blob) and is_json_object(blob):
+                return findings
+        for key, value in iter_top_level_items(json_path):
+            for term in match_terms(key):
+                findings.append(f"\nFound sensitive term '{term}' in {json_path}")
+                findings.append(f"Key: {key}")
+                findings.append(f"Value: {value}")
     
     except Exception as e:
         logger.error(f"Error processing {json_path}: {e}")
@@ -45,6 +219,68 @@ def check_sensitive_info(json_path: str, sensitive_terms: List[str]) -> List[str
     
     return findings
 
+def find_json_files(bids_dir: str) -> List[str]:
+    """
+    Recursively collect the paths of all JSON files under a directory.
+    
+    Parameters:
+    bids_dir (str): Path to BIDS directory
+    
+    Returns:
+    List[str]: Paths to every .json file found
+    """
+    json_paths = []
+    stack = [bids_dir]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('.json'):
+                    json_paths.append(entry.path)
+    json_paths.sort()
+    return json_paths
+
+def open_scan_cache(cache_path: str) -> sqlite3.Connection:
+    """
+    Open (creating if needed) the on-disk cache of already-scanned JSON files.
+    
+    Parameters:
+    cache_path (str): Path to the SQLite cache file
+    
+    Returns:
+    sqlite3.Connection: Open connection to the cache
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    conn = sqlite3.connect(cache_path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS seen ("
+        "path TEXT, terms TEXT, mtime INTEGER, size INTEGER, findings TEXT, "
+        "PRIMARY KEY (path, terms))"
+    )
+    return conn
+
+def lookup_cached_findings(conn: sqlite3.Connection, json_path: str, terms_key: str,
+                           st: os.stat_result) -> Optional[List[str]]:
+    """
+    Return the cached findings for a file if it is unchanged since it was scanned.
+    
+    Parameters:
+    conn (sqlite3.Connection): Cache connection from open_scan_cache
+    json_path (str): Path to the JSON file
+    terms_key (str): Sensitive terms the cached findings were computed for
+    st (os.stat_result): Current stat of the file
+    
+    Returns:
+    Optional[List[str]]: Cached findings, or None on a cache miss
+    """
+    row = conn.execute(
+        "SELECT findings FROM seen WHERE path=? AND terms=? AND mtime=? AND size=?",
+        (os.path.abspath(json_path), terms_key, st.st_mtime_ns, st.st_size)
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
 def main():
     """
     Main function to check BIDS directory for sensitive information in JSON files.
@@ -64,6 +300,12 @@ def main():
     - Medical info: diagnosis, condition, treatment
     - Location: zip, city, state, country
     Default terms: zip, date, dob, name, ssn, age, sex, address, phone, email, birth, patient, subject''')
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_PATH, default=None, metavar='PATH',
+                        help='Reuse results for unchanged files from a cache at PATH (default when given '
+                             f'without PATH: {DEFAULT_CACHE_PATH}). Off unless given; the cache stores the '
+                             'findings, including the sensitive values, on disk')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not read or update the cache, even if --cache is given')
     
     args = parser.parse_args()
 
@@ -75,30 +317,61 @@ def main():
     all_findings = []
     
     # Recursively find all JSON files
-    json_count = 0
-    for root, _, files in os.walk(args.bids_dir):
-        for file in files:
-            if file.endswith('.json'):
-                json_path = os.path.join(root, file)
-                json_count += 1
-                logger.debug(f"Checking {json_path}")
-                findings = check_sensitive_info(json_path, args.terms)
-                all_findings.extend(findings)
-
-    # Write findings to file
-    with open(args.output_file, 'w', encoding='utf-8') as f:
-        f.write(f"=== Sensitive Information Check Results ===\n")
-        f.write(f"BIDS Directory: {args.bids_dir}\n")
-        f.write(f"Total JSON files checked: {json_count}\n")
-        f.write(f"Total findings: {len(all_findings)}\n")
-        f.write(f"Terms checked: {', '.join(args.terms)}\n\n")
-        
-        if all_findings:
-            f.write("=== Findings ===\n")
-            for finding in all_findings:
-                f.write(f"{finding}\n")
-        else:
-            f.write("No sensitive information found.\n")
+    json_paths = find_json_files(args.bids_dir)
+    json_count = len(json_paths)
+    
+    # Reuse the findings of files unchanged since the last run
+    cache = None if args.no_cache or args.cache is None else open_scan_cache(args.cache)
+    terms_key = '\0'.join(args.terms)
+    results = {}
+    stats = {}
+    if cache is not None:
+        for json_path in json_paths:
+            st = os.stat(json_path, follow_symlinks=False)
+            stats[json_path] = st
+            cached = lookup_cached_findings(cache, json_path, terms_key, st)
+            if cached is not None:
+                results[json_path] = cached
+        logger.info(f"Reusing cached results for {len(results)} unchanged files")
+    to_scan = [p for p in json_paths if p not in results]
+    
+    # Reading sidecars is I/O bound, so check them on a thread pool
+    match_terms = build_term_matcher(args.terms)
+    may_match = build_byte_prefilter(args.terms)
+    with ThreadPoolExecutor(max_workers=IO_WORKERS) as executor:
+        for json_path, findings in zip(to_scan, executor.map(lambda p: check_sensitive_info(p, match_terms, may_match), to_scan)):
+            results[json_path] = findings
+    
+    if cache is not None:
+        with cache:
+            cache.executemany(
+                "INSERT OR REPLACE INTO seen (path, terms, mtime, size, findings) VALUES (?, ?, ?, ?, ?)",
+                [(os.path.abspath(p), terms_key, stats[p].st_mtime_ns, stats[p].st_size, json.dumps(results[p]))
+                 for p in to_scan
+                 # Don't cache read errors so the file is retried next time
+                 if not any(finding.startswith("\nError processing") for finding in results[p])]
+            )
+        cache.close()
+    
+    # Keep the findings in path order
+    for json_path in json_paths:
+        all_findings.extend(results[json_path])
+
+    # Build the report in memory and write it in one call
+    header = (
+        f"=== Sensitive Information Check Results ===\n"
+        f"BIDS Directory: {args.bids_dir}\n"
+        f"Total JSON files checked: {json_count}\n"
+        f"Total findings: {len(all_findings)}\n"
+        f"Terms checked: {', '.join(args.terms)}\n\n"
+    )
+    if all_findings:
+        body = "=== Findings ===\n" + "\n".join(all_findings) + "\n"
+    else:
+        body = "No sensitive information found.\n"
+    
+    with open(args.output_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        f.write(header + body)
 
     logger.info(f"Check complete. Results written to {args.output_file}")
     if all_findings:
@@ -1,36 +1,98 @@
 #!/usr/bin/env python3
 # convert_and_organize.py
 import os
+import re
+import errno
+import functools
+import itertools
 import sys
+import gzip
 import shutil
 import logging
 from pathlib import Path
 from .utils import get_output_path, setup_logging
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .utils.config import Config
 from datetime import datetime
+from typing import List, Optional, Pattern, Tuple, Union
 
 ################################################################################
 # LOGGING CONFIGURATION
 ################################################################################
 logger = logging.getLogger(__name__)
 
+# Folders generate_bids_structure creates under <subject>/ses-01; they never
+# hold unconverted DICOMs
+BIDS_OUTPUT_DIRS = frozenset({"anat", "dwi", "fmri", "localized", "questionable"})
+
+################################################################################
+# SCAN CLASSIFICATION
+################################################################################
+# One anchored pass classifies a filename. Each branch is a lookahead, so the
+# alternation is tried in priority order (localizer, then DWI, ...) rather
+# than by position.
+SCAN_CLASSIFIER = re.compile(
+    r'^(?:'
+    r'(?=.*?_LOC_)(?P<loc>)'
+    r'|(?=.*?(?i:dti_|_dwi|dwi_))(?P<dwi>)'
+    r'|(?=.*?_T1_)(?P<t1>)'
+    r'|(?=.*?T2_)(?P<t2>)'
+    r'|(?=.*?bold_)(?P<bold>)'
+    r')'
+)
+
+# Destination (relative to the session directory) for each classifier group
+SCAN_DESTINATIONS = {
+    'loc': ('localized',),
+    'dwi': ('dwi',),
+    't1': ('anat', 'T1'),
+    't2': ('anat', 'T2'),
+    'bold': ('fmri',),
+}
+
+# Filename fix-ups applied by cleanup, per session subdirectory:
+# (subdirectory, compiled pattern, replacement)
+SCAN_RENAMES = (
+    ('dwi', re.compile(r"_b0_"), "_b500_1000_"),
+    ('fmri', re.compile(r"CANB"), ""),
+)
+
 ################################################################################
 # FUNCTIONS
 ################################################################################
 
+@functools.lru_cache(maxsize=1)
+def find_dcm2niix() -> Optional[str]:
+    """
+    Resolve the dcm2niix executable on PATH once per process.
+
+    Returns:
+    Optional[str]: Absolute path to dcm2niix, or None if it is not installed
+    """
+    return shutil.which('dcm2niix')
+
+@functools.lru_cache(maxsize=1)
 def check_dcm2niix() -> bool:
     """
     Check if dcm2niix is installed and accessible.
+
+    The PATH lookup is done in-process with shutil.which, and the result is
+    cached so repeated calls do not launch `dcm2niix --version` again.
     
     Returns:
     bool: True if dcm2niix is installed and accessible, False otherwise
     """
+    exe = find_dcm2niix()
+    if exe is None:
+        logger.error("dcm2niix is not installed or not in PATH")
+        return False
     try:
         # Try to run dcm2niix with --version flag
-        result = subprocess.run(['dcm2niix', '--version'], 
+        result = subprocess.run([exe, '--version'], 
                               capture_output=True, 
-                              text=True)
+                              text=True,
+                              timeout=5)
         # dcm2niix returns non-zero exit code even when version is printed successfully
         if "Chris Rorden's dcm2niiX version" in result.stdout:
             logger.info("dcm2niix is installed and accessible")
@@ -38,84 +100,319 @@ def check_dcm2niix() -> bool:
         else:
             logger.error("dcm2niix is installed but returned unexpected output")
             return False
-    except FileNotFoundError:
-        logger.error("dcm2niix is not installed or not in PATH")
-        return False
     except Exception as e:
         logger.error(f"Error checking dcm2niix: {e}")
         return False
 
-def create_bids_dir(old_dir: Path, new_dir: Path):
+def same_dir_entry(src: str, dst: str) -> bool:
+    """Whether `src` and `dst` name the same directory entry, not just the same inode."""
+    return (os.path.basename(src) == os.path.basename(dst)
+            and os.path.samefile(os.path.dirname(src) or ".", os.path.dirname(dst) or "."))
+
+def copy_file(src: str, dst: str) -> str:
     """
-    Copy the entire `old_dir` structure into `new_dir`.
+    Copy `src` to `dst` with os.copy_file_range, which the kernel can turn
+    into a reflink or an in-kernel copy, falling back to shutil.copy2.
+
+    An existing `dst` is never opened for writing, since it may be a
+    hardlink to `src` (or another source) from an earlier run: it is
+    unlinked and replaced by a new file. If `dst` is `src` itself, nothing
+    is done.
+    """
+    if os.path.lexists(dst):
+        if same_dir_entry(src, dst):
+            return dst
+        os.unlink(dst)
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "xb") as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                shutil.copystat(src, dst)
+                return dst
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return dst
+
+# os.link errors meaning "cannot hardlink here" rather than a real failure
+LINK_UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.EPERM, errno.EMLINK)
+
+def link_or_copy(src: str, dst: str) -> str:
+    """
+    Hardlink `src` to `dst`, falling back to copy_file when linking is not
+    possible (across filesystems, no permission, too many links).
+
+    A `dst` that is already a hardlink to `src` (from an earlier run) is
+    left as is; any other existing `dst`, including a symlink or a dangling
+    one, is unlinked first, never written to.
     """
+    try:
+        dst_stat = os.lstat(dst)
+    except FileNotFoundError:
+        pass
+    else:
+        src_stat = os.stat(src)
+        if (dst_stat.st_ino, dst_stat.st_dev) == (src_stat.st_ino, src_stat.st_dev):
+            return dst
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+        return dst
+    except OSError as e:
+        if e.errno not in LINK_UNSUPPORTED_ERRNOS:
+            raise
+        return copy_file(src, dst)
+
+def create_bids_dir(old_dir: Path, new_dir: Path, link_mode: str = "hardlink"):
+    """
+    Mirror the entire `old_dir` structure into `new_dir`.
+
+    With link_mode "hardlink" files are hardlinked rather than copied, so
+    the mirror shares inodes with the sources: writing into a mirrored file
+    in place would change the source DICOM too. The pipeline only removes,
+    renames or adds files in the mirror, and a rerun leaves files that are
+    already linked alone and replaces other existing files instead of
+    writing through them. Use "copy" to force independent copies. If
+    `old_dir` and `new_dir` are the same directory (e.g. a bind mount),
+    nothing is copied.
+
+    Parameters:
+    old_dir (Path): Source DICOM directory
+    new_dir (Path): BIDS directory to populate
+    link_mode (str): "hardlink" or "copy"
+    """
+    if link_mode not in ("hardlink", "copy"):
+        raise ValueError(f"Unknown link_mode: {link_mode}")
     if not new_dir.exists():
         new_dir.mkdir(parents=True)
+    elif os.path.samefile(old_dir, new_dir):
+        logger.info(f"{old_dir} and {new_dir} are the same directory; skipping copy")
+        return
     logger.info(f"Copying {old_dir} -> {new_dir}")
-    shutil.copytree(old_dir, new_dir, dirs_exist_ok=True)
+    copy_function = link_or_copy if link_mode == "hardlink" else copy_file
+    shutil.copytree(old_dir, new_dir, copy_function=copy_function, dirs_exist_ok=True)
     logger.info("Finished copying directory structure.")
 
+def find_dcm_dirs(root: Path):
+    """
+    Walk `root` (a subject directory) with os.scandir and yield every
+    directory holding .dcm files.
+
+    Each directory is listed exactly once; scandir's cached entry types avoid
+    a stat call per entry. The BIDS output folders directly under
+    `root`/ses-01 (see BIDS_OUTPUT_DIRS) are not descended into; folders with
+    the same names anywhere else are walked as usual.
+
+    Yields:
+    Tuple[Path, int]: Directory path and the number of .dcm files in it
+    """
+    session_dir = os.path.join(str(root), "ses-01")
+    stack = [str(root)]
+    while stack:
+        current = stack.pop()
+        pruned = BIDS_OUTPUT_DIRS if current == session_dir else ()
+        dcm_count = 0
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in pruned:
+                        stack.append(entry.path)
+                elif entry.name.endswith(".dcm"):
+                    dcm_count += 1
+        if dcm_count:
+            yield Path(current), dcm_count
+
+def remove_dcm_files(folder: Path):
+    """
+    Delete the .dcm files in `folder` during a single scandir pass.
+    """
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.name.endswith(".dcm"):
+                try:
+                    os.unlink(entry.path)
+                    logger.info("Removed DICOM file: %s", entry.path)
+                except OSError as e:
+                    logger.warning("Could not remove %s: %s", entry.path, e)
+
+def iter_files_with_suffix(root: Path, suffix: Union[str, Tuple[str, ...]]):
+    """
+    Walk `root` with os.scandir and yield the path of every file ending in
+    `suffix` (a string or a tuple of alternatives, as for str.endswith).
+    """
+    stack = [str(root)]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(suffix) and entry.is_file(follow_symlinks=False):
+                    yield entry.path
+
+def gzip_file(path: str, compresslevel: int = 1) -> str:
+    """
+    Stream-compress `path` to `path.gz` in-process and remove the original.
+
+    Data is fed to zlib in 4 MiB chunks, and the gzip header carries mtime=0
+    so recompressing the same volume gives byte-identical output.
+
+    Returns:
+    str: Path to the compressed file
+    """
+    gz_path = path + ".gz"
+    with open(path, "rb") as src, \
+            gzip.GzipFile(gz_path, "wb", compresslevel=compresslevel, mtime=0) as dst:
+        shutil.copyfileobj(src, dst, length=4 << 20)
+    os.unlink(path)
+    return gz_path
+
+def pigz_files(paths: List[str], compresslevel: int = 1, chunk_size: int = 1000) -> bool:
+    """
+    Compress `paths` in place with multi-threaded pigz, one process per chunk
+    of files (chunked to stay below ARG_MAX).
+
+    Returns:
+    bool: True if every pigz invocation succeeded
+    """
+    pigz = shutil.which("pigz")
+    if pigz is None:
+        return False
+    ok = True
+    for start in range(0, len(paths), chunk_size):
+        chunk = paths[start:start + chunk_size]
+        result = subprocess.run([pigz, "-p", str(os.cpu_count() or 1), f"-{compresslevel}", "-f", "--", *chunk],
+                                check=False)
+        if result.returncode != 0:
+            logger.warning(f"pigz exited with code {result.returncode}")
+            ok = False
+    return ok
+
+def convert_dicom_folder(folder: Path, log_header: str, conversion_log: str, errors_log: str,
+                         compress: bool = True) -> Path:
+    """
+    Run dcm2niix on a single folder, then remove its .dcm files.
+
+    If `compress` is False, dcm2niix writes uncompressed .nii files.
+
+    Each folder gets its own log pair so parallel conversions never interleave
+    their output.
+
+    Returns:
+    Path: The converted folder
+    """
+    # Use -v for verbose output and -y to overwrite existing files.
+    # -z i compresses with the internal single-threaded zlib so that parallel
+    # instances do not each spawn a multi-threaded pigz.
+    cmd = [find_dcm2niix() or 'dcm2niix', '-v', 'y', '-y', 'y', '-b', 'y', '-z', 'i' if compress else 'n',
+           '-f', '%d_%s', str(folder)]
+    logger.info(f"Running: {' '.join(cmd)}")
+    # Unbuffered handles: the header lands before dcm2niix writes to the fds
+    header = log_header.encode()
+    with open(conversion_log, "wb", buffering=0) as out, open(errors_log, "wb", buffering=0) as err:
+        out.write(header)
+        err.write(header)
+        subprocess.run(cmd, stdout=out, stderr=err, check=False)
+
+    # Remove DICOM files after conversion
+    remove_dcm_files(folder)
+    return folder
+
 def run_dcm2niix_on_unprocessed(base_path: Path, config: Config):
     """
     Find folders with .dcm files, convert them to NIfTI, remove .dcm.
-    """
-    unprocessed_folders = []
-    for subfolder in base_path.rglob("*"):
-        if subfolder.is_dir() and any(subfolder.glob("*.dcm")):
-            unprocessed_folders.append(subfolder)
 
-    total_folders = len(unprocessed_folders)
-    print(f"Found {total_folders} folders with DICOM files to process")
+    Folders are independent, so dcm2niix runs on several of them at once.
+    Conversions are submitted as soon as the walk finds each folder, so they
+    overlap with the rest of the directory discovery.
+    """
+    # Per-folder logs are written under outputs/log/dcm2niix and merged into
+    # dcm2niix.log / dcm2niix.err once all conversions have finished
+    log_dir = Path(config.paths.log_dir)
+    folder_log_dir = log_dir / "dcm2niix"
+    folder_log_dir.mkdir(parents=True, exist_ok=True)
+
+    jobs = []
+    futures = []
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        dcm_dirs = itertools.chain.from_iterable(
+            find_dcm_dirs(subject_dir)
+            for subject_dir in list_subject_dirs(base_path, config.paths.subject_prefix))
+        for idx, (folder_to_convert, dcm_count) in enumerate(dcm_dirs, 1):
+            # Extract subject information from the path
+            try:
+                # Get the relative path from base_path to get the correct subject ID
+                rel_path = folder_to_convert.relative_to(base_path)
+                subject_id = rel_path.parts[0]  # First part of relative path is subject ID
+                scan_folder = folder_to_convert.name
+            except Exception as e:
+                logger.warning(f"Could not extract subject info from path {folder_to_convert}: {e}")
+                subject_id = "Unknown"
+                scan_folder = folder_to_convert.name
 
-    for idx, folder_to_convert in enumerate(unprocessed_folders, 1):
-        # Extract subject information from the path
-        try:
-            # Get the relative path from base_path to get the correct subject ID
-            rel_path = folder_to_convert.relative_to(base_path)
-            subject_id = rel_path.parts[0]  # First part of relative path is subject ID
-            scan_folder = folder_to_convert.name
-        except Exception as e:
-            logger.warning(f"Could not extract subject info from path {folder_to_convert}: {e}")
-            subject_id = "Unknown"
-            scan_folder = folder_to_convert.name
-
-        print(f"\nProcessing folder {idx}/{total_folders}:")
-        print(f"Subject: {subject_id}")
-        print(f"Folder: {scan_folder}")
-        
-        # Add header to log files in outputs/log directory
-        conversion_log = str(Path(config.paths.log_dir) / "dcm2niix.log")
-        errors_log = str(Path(config.paths.log_dir) / "dcm2niix.err")
-        
-        log_header = f"""
+            log_header = f"""
 === Processing DICOM folder ===
 Subject ID: {subject_id}
 Folder Name: {scan_folder}
 Full Path: {folder_to_convert}
-Number of DICOM files: {len(list(folder_to_convert.glob("*.dcm")))}
+Number of DICOM files: {dcm_count}
 Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 """
-        
-        with open(conversion_log, "a") as f:
-            f.write(log_header)
-        with open(errors_log, "a") as f:
-            f.write(log_header)
-        
-        # Use -v for verbose output and -y to overwrite existing files
-        cmd = f'dcm2niix -v y -y y -b y -z y -f "%d_%s" "{folder_to_convert}" >> {conversion_log} 2>> {errors_log}'
-        logger.info(f"Running: {cmd}")
-        os.system(cmd)
-
-        # Remove DICOM files after conversion
-        dcm_files = list(folder_to_convert.glob("*.dcm"))
-        for df in dcm_files:
+            log_stem = f"{idx:05d}_{subject_id}_{scan_folder}"
+            conversion_log = str(folder_log_dir / f"{log_stem}.log")
+            errors_log = str(folder_log_dir / f"{log_stem}.err")
+            job = (folder_to_convert, log_header, conversion_log, errors_log,
+                   config.processing.compress_nifti)
+            jobs.append(job)
+            futures.append(executor.submit(convert_dicom_folder, *job))
+
+        total_folders = len(jobs)
+        print(f"Found {total_folders} folders with DICOM files to process")
+
+        for done, future in enumerate(as_completed(futures), 1):
             try:
-                os.remove(df)
-                logger.info(f"Removed DICOM file: {df}")
+                folder = future.result()
+                print(f"Converted folder {done}/{total_folders}: {folder.name}")
             except Exception as e:
-                logger.warning(f"Could not remove {df}: {e}")
+                logger.error(f"dcm2niix conversion failed: {e}")
+
+    # Merge the per-folder logs in discovery order through one buffered
+    # handle per master log, copying raw bytes
+    with open(log_dir / "dcm2niix.log", "ab", buffering=1 << 16) as conversion_out, \
+            open(log_dir / "dcm2niix.err", "ab", buffering=1 << 16) as errors_out:
+        for _, _, conversion_log, errors_log, _ in jobs:
+            for part, out in ((conversion_log, conversion_out), (errors_log, errors_out)):
+                try:
+                    with open(part, "rb") as f:
+                        shutil.copyfileobj(f, out)
+                    os.remove(part)
+                except FileNotFoundError:
+                    pass
+    try:
+        folder_log_dir.rmdir()
+    except OSError:
+        pass
+
+def list_subject_dirs(base_path: Path, subject_prefix: str) -> List[Path]:
+    """
+    List the subject directories directly under `base_path`, sorted by name.
 
-def generate_bids_structure(base_path: Path):
+    main() lists them once and hands the result to every later stage, so the
+    BIDS root is not re-read by each of them. Every caller passes
+    paths.subject_prefix; when it is set, directories not starting with it
+    (sourcedata/, derivatives/, code/, ...) are left out and never walked.
+    """
+    with os.scandir(base_path) as it:
+        return sorted(Path(entry.path) for entry in it
+                      if entry.name.startswith(subject_prefix) and entry.is_dir())
+
+def generate_bids_structure(base_path: Path, config: Config, subject_dirs: Optional[List[Path]] = None):
     """
     For each subject, create partial BIDS subfolders (anat/T1, T2, dwi, fmri, etc.).
     """
@@ -127,14 +424,15 @@ def generate_bids_structure(base_path: Path):
         "ses-01/localized",
         "ses-01/questionable"
     ]
-    for subject_dir in base_path.iterdir():
-        if subject_dir.is_dir():
-            for d in dirs_to_make:
-                path_to_make = subject_dir / d
-                path_to_make.mkdir(parents=True, exist_ok=True)
-            logger.info(f"Created BIDS subfolders for {subject_dir.name}")
-
-def sort_files(base_path: Path):
+    if subject_dirs is None:
+        subject_dirs = list_subject_dirs(base_path, config.paths.subject_prefix)
+    for subject_dir in subject_dirs:
+        for d in dirs_to_make:
+            path_to_make = subject_dir / d
+            path_to_make.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Created BIDS subfolders for {subject_dir.name}")
+
+def sort_files(base_path: Path, config: Config, subject_dirs: Optional[List[Path]] = None):
     """
     Move newly converted .nii.gz into correct subfolders:
         T1 -> anat/T1
@@ -143,203 +441,245 @@ def sort_files(base_path: Path):
         bold_ -> fmri
         _LOC_ -> localized
     """
-    logger.info(f"Starting file sorting in base path: {base_path}")
+    logger.info("Starting file sorting in base path: %s", base_path)
+    
+    # Directory listings are only for debugging; skip the extra scans otherwise
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
     
     # First, let's see what's in the base path
-    logger.info("Contents of base path:")
-    for item in base_path.iterdir():
-        logger.debug(f"  - {item.name} (is_dir: {item.is_dir()})")
+    if debug_enabled:
+        logger.debug("Contents of base path:")
+        for item in base_path.iterdir():
+            logger.debug("  - %s (is_dir: %s)", item.name, item.is_dir())
     
-    for subject_dir in base_path.iterdir():
+    # List the subjects once; both the sorting and the cleanup check reuse it
+    if subject_dirs is None:
+        subject_dirs = list_subject_dirs(base_path, config.paths.subject_prefix)
+    
+    # Entries left behind in each DICOM directory, recorded during sorting so
+    # the cleanup check below does not list the directories again
+    remaining = {}
+    cross_device_warned = False
+    
+    for subject_dir in subject_dirs:
         logger.info(f"\nProcessing subject directory: {subject_dir}")
-        if subject_dir.is_dir():
-            logger.info(f"Found valid subject dir: {subject_dir}")
-            
-            # Let's see what's in the subject directory
-            logger.info("Contents of subject directory:")
+        
+        # Let's see what's in the subject directory
+        if debug_enabled:
+            logger.debug("Contents of subject directory:")
             for item in subject_dir.iterdir():
-                logger.debug(f"  - {item.name} (is_dir: {item.is_dir()})")
-            
-            subject_ses01 = subject_dir / "ses-01"
-            logger.info(f"Subject session directory: {subject_ses01}")
-            
-            # Check if the session directory exists and what's in it
-            if subject_ses01.exists():
-                logger.info("Contents of session directory:")
+                logger.debug("  - %s (is_dir: %s)", item.name, item.is_dir())
+        
+        subject_ses01 = subject_dir / "ses-01"
+        logger.info(f"Subject session directory: {subject_ses01}")
+        
+        # Destination directories, built once per subject
+        dest_dirs = {
+            kind: subject_ses01.joinpath(*parts)
+            for kind, parts in SCAN_DESTINATIONS.items()
+        }
+        
+        # Check if the session directory exists and what's in it
+        if subject_ses01.exists():
+            if debug_enabled:
+                logger.debug("Contents of session directory:")
                 for item in subject_ses01.iterdir():
-                    logger.debug(f"  - {item.name} (is_dir: {item.is_dir()})")
-            else:
-                logger.warning(f"Session directory does not exist: {subject_ses01}")
-
-            # Look for files in the DICOM directory
-            dicom_dir = subject_dir / "DICOM"
-            if not dicom_dir.exists():
-                logger.warning(f"DICOM directory not found: {dicom_dir}")
-                continue
+                    logger.debug("  - %s (is_dir: %s)", item.name, item.is_dir())
+        else:
+            logger.warning(f"Session directory does not exist: {subject_ses01}")
+
+        # Look for files in the DICOM directory
+        dicom_dir = subject_dir / "DICOM"
+        if not dicom_dir.exists():
+            logger.warning(f"DICOM directory not found: {dicom_dir}")
+            continue
 
-            logger.info(f"Looking for files in DICOM directory: {dicom_dir}")
-            logger.info("Contents of DICOM directory:")
+        logger.info(f"Looking for files in DICOM directory: {dicom_dir}")
+        if debug_enabled:
+            logger.debug("Contents of DICOM directory:")
             for item in dicom_dir.iterdir():
-                logger.debug(f"  - {item.name} (is_dir: {item.is_dir()})")
-
-            # Move localizer
-            logger.info("Checking for localizer files...")
-            localizer_files = list(dicom_dir.glob("*_LOC_*"))
-            logger.info(f"Found {len(localizer_files)} localizer files")
-            for f in localizer_files:
-                if f.is_file():
-                    logger.info(f"Found localizer file: {f}")
-                    dest = subject_ses01 / "localized" / f.name
-                    try:
-                        shutil.move(str(f), str(dest))
-                        logger.info(f"Moved localizer {f.name} -> {dest}")
-                    except Exception as e:
-                        logger.warning(f"Failed to move localizer {f.name}: {e}")
-
-            # Move T1, T2, dwi, fmri
-            logger.info("Checking for other scan types...")
-            all_files = list(dicom_dir.glob("*"))
-            logger.info(f"Found {len(all_files)} total files/directories")
-            for f in all_files:
-                if not f.is_file():
-                    continue
-                    
-                fn = f.name
-                logger.debug(f"Processing file: {fn}")
-                
-                # Enhanced DWI pattern matching
-                if any(pattern in fn.lower() for pattern in ["dti_", "_dwi_", "_dwi", "dwi_"]):
-                    dest = subject_ses01 / "dwi" / fn
-                    logger.debug(f"Identified as DWI scan -> {dest}")
-                elif "_T1_" in fn:
-                    dest = subject_ses01 / "anat" / "T1" / fn
-                    logger.debug(f"Identified as T1 scan -> {dest}")
-                elif "T2_" in fn:
-                    dest = subject_ses01 / "anat" / "T2" / fn
-                    logger.debug(f"Identified as T2 scan -> {dest}")
-                elif "bold_" in fn:
-                    dest = subject_ses01 / "fmri" / fn
-                    logger.debug(f"Identified as fMRI scan -> {dest}")
-                else:
-                    logger.debug(f"Skipping file (no matching pattern): {fn}")
-                    continue
+                logger.debug("  - %s (is_dir: %s)", item.name, item.is_dir())
+
+        # Move localizer, T1, T2, dwi, fmri in a single pass
+        logger.info("Sorting scan files...")
+        with os.scandir(dicom_dir) as it:
+            entries = list(it)
+        leftovers = remaining[dicom_dir] = [entry for entry in entries if not entry.is_file()]
+        entries = [entry for entry in entries if entry.is_file()]
+        logger.info(f"Found {len(entries)} files")
+        for entry in entries:
+            fn = entry.name
+            if debug_enabled:
+                logger.debug("Processing file: %s", fn)
+            
+            match = SCAN_CLASSIFIER.match(fn)
+            if match is None:
+                if debug_enabled:
+                    logger.debug("Skipping file (no matching pattern): %s", fn)
+                leftovers.append(entry)
+                continue
+            scan_kind = match.lastgroup
+            dest = dest_dirs[scan_kind] / fn
+            if debug_enabled:
+                logger.debug("Identified as %s scan -> %s", scan_kind, dest)
 
+            try:
+                os.replace(entry.path, dest)
+                logger.info("Moved %s -> %s", fn, dest)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    logger.warning(f"Failed to move {fn} (errno {e.errno}): {e}")
+                    leftovers.append(entry)
+                    continue
+                # Destination is on another filesystem: copy-then-delete,
+                # warning once since every later move pays the same cost
+                if not cross_device_warned:
+                    logger.warning(f"{dest.parent} is on a different filesystem than "
+                                   f"{dicom_dir}; falling back to copying files")
+                    cross_device_warned = True
                 try:
-                    shutil.move(str(f), str(dest))
-                    logger.info(f"Moved {fn} -> {dest}")
-                except Exception as e:
-                    logger.warning(f"Failed to move {fn}: {e}")
+                    shutil.move(entry.path, dest)
+                    logger.info("Copied %s -> %s", fn, dest)
+                except OSError as e:
+                    logger.warning(f"Failed to move {fn} (errno {e.errno}): {e}")
+                    leftovers.append(entry)
 
     # After all files are processed, check and clean up DICOM folders
     logger.info("\n=== Checking DICOM folders for cleanup ===")
-    for subject_dir in base_path.iterdir():
-        if subject_dir.is_dir():
-            dicom_dir = subject_dir / "DICOM"
-            if dicom_dir.exists():
-                remaining_items = list(dicom_dir.iterdir())
-                if not remaining_items:
-                    try:
-                        dicom_dir.rmdir()
-                        logger.info(f"Removed empty DICOM directory: {dicom_dir}")
-                    except Exception as e:
-                        logger.error(f"Failed to remove empty DICOM directory {dicom_dir}: {e}")
-                else:
-                    logger.error(f"DICOM directory not empty after processing: {dicom_dir}")
-                    logger.error("Remaining items:")
-                    for item in remaining_items:
-                        logger.error(f"  - {item.name} (is_dir: {item.is_dir()})")
-
-def cleanup(base_path: Path, config: Config):
-    """
-    1) Remove leftover dti dirs
-    2) Gzip .nii if configured
+    for dicom_dir, remaining_items in remaining.items():
+        if not remaining_items:
+            try:
+                dicom_dir.rmdir()
+                logger.info(f"Removed empty DICOM directory: {dicom_dir}")
+            except Exception as e:
+                logger.error(f"Failed to remove empty DICOM directory {dicom_dir}: {e}")
+        else:
+            logger.error(f"DICOM directory not empty after processing: {dicom_dir}")
+            logger.error("Remaining items:")
+            for item in remaining_items:
+                logger.error(f"  - {item.name} (is_dir: {item.is_dir()})")
+
+def rename_matching(folder: Path, pattern: Pattern[str], replacement: str):
+    """
+    Rename every entry of `folder` whose name matches `pattern`, substituting
+    `replacement`, in one scandir pass. Missing folders are skipped.
+    """
+    try:
+        it = os.scandir(folder)
+    except FileNotFoundError:
+        return
+    with it:
+        for entry in it:
+            new_name, count = pattern.subn(replacement, entry.name)
+            if count:
+                os.rename(entry.path, os.path.join(folder, new_name))
+                logger.info(f"Renamed {entry.name} -> {new_name}")
+
+def cleanup_subject(subject_dir: Path, compress_nifti: bool) -> str:
+    """
+    Run every cleanup step for a single subject directory:
+    1) Remove leftover dti dir
+    2) Gzip .nii if requested
     3) Move suspiciously small .nii.gz in dwi
-    4) Rename _b0_ -> _b500_1000_, remove 'CANB'
-    """
-    # Remove leftover 'dti' directories
-    for subject_dir in base_path.iterdir():
-        if subject_dir.is_dir():
-            dti_path = subject_dir / "ses-01" / "dti"
-            if dti_path.exists():
-                has_contents = any(dti_path.iterdir())
-                shutil.rmtree(dti_path)
-                logger.info(f"Removed leftover dti folder {dti_path} (had contents? {has_contents})")
-
-    # Gzip any *.nii if configured
-    if config.processing.compress_nifti:
-        for subject_dir in base_path.iterdir():
-            if subject_dir.is_dir():
-                cmd = f'find "{subject_dir}" -type f -name "*.nii" -exec gzip {{}} \\;'
-                os.system(cmd)
-
-    # Set up small files log
-    small_files_log = str(Path(config.paths.log_dir) / "small_files.log")
+    4) Rename _b0_ -> _b500_1000_, remove 'CANB' (see SCAN_RENAMES)
+
+    Returns:
+    str: Small-file report entries for this subject (empty if none)
+    """
+    subject_ses01 = subject_dir / "ses-01"
+    report = []
+
+    # Remove leftover 'dti' directory
+    dti_path = subject_ses01 / "dti"
+    if dti_path.exists():
+        has_contents = any(dti_path.iterdir())
+        shutil.rmtree(dti_path)
+        logger.info(f"Removed leftover dti folder {dti_path} (had contents? {has_contents})")
+
+    # Gzip any *.nii
+    if compress_nifti:
+        for nii in list(iter_files_with_suffix(subject_dir, ".nii")):
+            try:
+                logger.info(f"Compressed {nii} -> {gzip_file(nii)}")
+            except Exception as e:
+                logger.warning(f"Could not compress {nii}: {e}")
+
+    # Identify suspiciously small .nii.gz in dwi
+    dwi_path = subject_ses01 / "dwi"
+    if dwi_path.exists():
+        # One scandir pass groups the files and sizes the .gz ones
+        small_groups = {}
+        with os.scandir(dwi_path) as it:
+            for entry in it:
+                name = entry.name
+                if not name.endswith(".gz") or not entry.is_file(follow_symlinks=False):
+                    continue
+                size = entry.stat(follow_symlinks=False).st_size
+                if size < 1_000_000:
+                    base_stem = name[:-7] if name.endswith(".nii.gz") else name[:-3]
+                    small_groups.setdefault(base_stem[-5:], []).append((entry, size))
+
+        questionable_dir = subject_ses01 / "questionable"
+        questionable_dir.mkdir(exist_ok=True)
+
+        for key, small_files in small_groups.items():
+            report.append(f"\nSubject: {subject_dir.name}\n")
+            report.append(f"Group: {key}\n")
+            report.append("Small files found:\n")
+            for entry, size in small_files:
+                size_mb = size / (1024 * 1024)  # Convert bytes to MB
+                report.append(f"  - {entry.name}: {size_mb:.2f} MB\n")
+            report.append("\n")
+
+            for entry, _ in small_files:
+                dest = questionable_dir / entry.name
+                try:
+                    os.replace(entry.path, dest)
+                    logger.info(f"Moved small file {entry.name} -> {dest}")
+                except OSError as e:
+                    logger.warning(f"Could not move {entry.name} (errno {e.errno}): {e}")
+
+    # Rename '_b0_' -> '_b500_1000_' in dwi, remove 'CANB' in fmri
+    for subdir, pattern, replacement in SCAN_RENAMES:
+        rename_matching(subject_ses01 / subdir, pattern, replacement)
+
+    return "".join(report)
+
+def cleanup(base_path: Path, config: Config, subject_dirs: Optional[List[Path]] = None) -> int:
+    """
+    Clean up every subject directory in a single pass (see cleanup_subject).
+
+    Subjects are independent, so they are cleaned on a thread pool; gzip
+    releases the GIL while compressing.
+
+    Returns:
+    int: Number of small-file groups written to small_files.log
+    """
+    small_files_log = Path(config.paths.log_dir) / "small_files.log"
+    if subject_dirs is None:
+        subject_dirs = list_subject_dirs(base_path, config.paths.subject_prefix)
+
+    # With pigz available, gzip every .nii in one batched multi-threaded call;
+    # otherwise each subject compresses its own files in-process
+    compress_in_subjects = config.processing.compress_nifti
+    if compress_in_subjects and shutil.which("pigz"):
+        nii_files = [nii for d in subject_dirs for nii in iter_files_with_suffix(d, ".nii")]
+        if nii_files:
+            logger.info(f"Compressing {len(nii_files)} NIfTI files with pigz")
+            pigz_files(nii_files)
+        # Anything pigz failed on is picked up by the in-process fallback
+        compress_in_subjects = any(os.path.exists(nii) for nii in nii_files)
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        reports = list(executor.map(
+            lambda d: cleanup_subject(d, compress_in_subjects), subject_dirs))
+
+    # Write the small files log in subject order
     with open(small_files_log, "w") as f:
         f.write("=== Small NIfTI Files Report ===\n\n")
+        f.writelines(reports)
 
-    # Identify suspiciously small .nii.gz in dwi
-    for subject_dir in base_path.iterdir():
-        if subject_dir.is_dir():
-            dwi_path = subject_dir / "ses-01" / "dwi"
-            if dwi_path.exists():
-                file_groups = {}
-                for f in dwi_path.iterdir():
-                    if f.is_file():
-                        base_stem = f.stem
-                        if base_stem.endswith(".nii"):
-                            base_stem = base_stem[:-4]
-                        group_key = base_stem[-5:]
-                        file_groups.setdefault(group_key, []).append(f)
-
-                questionable_dir = subject_dir / "ses-01" / "questionable"
-                questionable_dir.mkdir(exist_ok=True)
-
-                for key, files in file_groups.items():
-                    small_files = []
-                    for f in files:
-                        if f.suffix == ".gz":
-                            size = f.stat().st_size
-                            if size < 1_000_000:
-                                small_files.append((f, size))
-                    
-                    if small_files:
-                        with open(small_files_log, "a") as f:
-                            f.write(f"\nSubject: {subject_dir.name}\n")
-                            f.write(f"Group: {key}\n")
-                            f.write("Small files found:\n")
-                            for file_path, size in small_files:
-                                size_mb = size / (1024 * 1024)  # Convert bytes to MB
-                                f.write(f"  - {file_path.name}: {size_mb:.2f} MB\n")
-                            f.write("\n")
-                        
-                        for file_path, _ in small_files:
-                            dest = questionable_dir / file_path.name
-                            try:
-                                shutil.move(str(file_path), str(dest))
-                                logger.info(f"Moved small file {file_path.name} -> {dest}")
-                            except Exception as e:
-                                logger.warning(f"Could not move {file_path.name}: {e}")
-
-    # Rename '_b0_' -> '_b500_1000_', remove 'CANB'
-    for subject_dir in base_path.iterdir():
-        if subject_dir.is_dir():
-            dwi_path = subject_dir / "ses-01" / "dwi"
-            if dwi_path.exists():
-                for f in dwi_path.iterdir():
-                    if "_b0_" in f.name:
-                        new_name = f.name.replace("_b0_", "_b500_1000_")
-                        new_path = dwi_path / new_name
-                        f.rename(new_path)
-                        logger.info(f"Renamed {f.name} -> {new_name}")
-
-            fmri_path = subject_dir / "ses-01" / "fmri"
-            if fmri_path.exists():
-                for f in fmri_path.iterdir():
-                    if "CANB" in f.name:
-                        new_name = f.name.replace("CANB", "")
-                        new_path = fmri_path / new_name
-                        f.rename(new_path)
-                        logger.info(f"Renamed {f.name} -> {new_name}")
+    return sum(report.count("Subject:") for report in reports)
 
 ################################################################################
 # MAIN
@@ -357,6 +697,7 @@ def main(config: Config):
     # Convert string paths to Path objects
     dicom_dir = Path(config.paths.dicom_dir)
     bids_dir = Path(config.paths.bids_dir)
+    log_dir = Path(config.paths.log_dir)
 
     print("\n=== Starting DICOM to BIDS Conversion Pipeline ===")
     print(f"DICOM Directory: {dicom_dir}")
@@ -374,7 +715,7 @@ def main(config: Config):
 
     # Create BIDS directory structure with copies of DICOM files
     print("\nStep 2/5: Copying DICOM files to BIDS directory...")
-    create_bids_dir(dicom_dir, bids_dir)
+    create_bids_dir(dicom_dir, bids_dir, config.processing.link_mode)
     print("✓ DICOM files copied successfully")
 
     # Run dcm2niix on the copied files in bids_dir
@@ -382,26 +723,23 @@ def main(config: Config):
     run_dcm2niix_on_unprocessed(bids_dir, config)
     print("✓ DICOM to NIfTI conversion complete")
 
+    # Conversion does not add or remove subjects, so list them once for
+    # the remaining stages
+    subject_dirs = list_subject_dirs(bids_dir, config.paths.subject_prefix)
+
     # Generate BIDS structure
     print("\nStep 4/5: Organizing files into BIDS structure...")
-    generate_bids_structure(bids_dir)
-    sort_files(bids_dir)
+    generate_bids_structure(bids_dir, config, subject_dirs)
+    sort_files(bids_dir, config, subject_dirs)
     print(f"✓ Files organized into BIDS structure at: {bids_dir}")
 
     # Clean up temporary files
     print("\nStep 5/5: Performing final cleanup...")
-    cleanup(bids_dir, config)
-    
-    # Count small files from the log
-    small_files_log = Path(config.paths.log_dir) / "small_files.log"
-    if small_files_log.exists():
-        with open(small_files_log, "r") as f:
-            content = f.read()
-            small_files_count = content.count("Subject:")
-        print(f"✓ Cleanup complete. Found {small_files_count} suspiciously small files")
-        print(f"  Small files report available at: {small_files_log}")
-    else:
-        print("✓ Cleanup complete. No small files found")
+    # cleanup reports the count directly, so the log isn't read back
+    small_files_count = cleanup(bids_dir, config, subject_dirs)
+    small_files_log = log_dir / "small_files.log"
+    print(f"✓ Cleanup complete. Found {small_files_count} suspiciously small files")
+    print(f"  Small files report available at: {small_files_log}")
 
     print("\n=== DICOM to BIDS Conversion Complete! ===")
     logger.info("DICOM to BIDS conversion complete!")
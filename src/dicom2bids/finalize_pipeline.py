@@ -2,19 +2,30 @@
 # finalize_pipeline.py
 
 import os
+import re
 import sys
 import logging
-import gzip
 import shutil
 import pandas as pd
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 from .utils.config import Config
 from .utils.logging import setup_logging
+from .convert_and_organize import gzip_file, iter_files_with_suffix, pigz_files
+
+try:
+    import pyarrow  # optional: multi-threaded C++ CSV reader for pandas
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = None
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Case-insensitive match for DWI/DTI image files, compiled once
+DWI_FILE_PATTERN = re.compile(r'dwi|dti', re.IGNORECASE)
+
 def compress_dwi_files(bids_dir: str) -> Dict[str, List[str]]:
     """
     Compress uncompressed DWI files (.nii) to gzipped format (.nii.gz).
@@ -32,34 +43,63 @@ def compress_dwi_files(bids_dir: str) -> Dict[str, List[str]]:
         'errors': []
     }
     
-    for root, _, files in os.walk(bids_dir):
-        # Find all DWI files
-        dwi_files = [f for f in files if ('dwi' in f.lower() or 'dti' in f.lower())]
-        for dwi_file in dwi_files:
-            file_path = os.path.join(root, dwi_file)
-            if file_path.endswith('.nii.gz'):
-                logger.info(f"Skipping already compressed file: {file_path}")
-                results['already_compressed'].append(file_path)
-            elif file_path.endswith('.nii'):
-                gz_path = file_path + '.gz'
-                try:
-                    # Compress the file using gzip
-                    with open(file_path, 'rb') as f_in:
-                        with gzip.open(gz_path, 'wb') as f_out:
-                            shutil.copyfileobj(f_in, f_out)
-                    # Remove original uncompressed file after successful compression
-                    os.remove(file_path)
-                    logger.info(f"Compressed: {file_path} -> {gz_path}")
-                    results['compressed'].append(file_path)
-                except Exception as e:
-                    error_msg = f"Error compressing {file_path}: {e}"
-                    logger.error(error_msg)
-                    results['errors'].append(error_msg)
+    # A single scandir walk filters on the NIfTI suffix straight from the
+    # directory entries; the name is lowercased once for the DWI/DTI check
+    to_compress = []
+    for file_path in iter_files_with_suffix(bids_dir, ('.nii', '.nii.gz')):
+        name_lc = os.path.basename(file_path).lower()
+        if 'dwi' not in name_lc and 'dti' not in name_lc:
+            continue
+        if file_path.endswith('.nii.gz'):
+            logger.debug(f"Skipping already compressed file: {file_path}")
+            results['already_compressed'].append(file_path)
+        else:
+            to_compress.append(file_path)
+
+    # With pigz available, compress everything in one batched multi-threaded
+    # call; whatever it leaves uncompressed goes through the fallback below
+    if to_compress and shutil.which('pigz'):
+        pigz_files(to_compress)
+        pending = []
+        for file_path in to_compress:
+            if os.path.exists(file_path):
+                pending.append(file_path)
+            else:
+                logger.debug(f"Compressed: {file_path} -> {file_path}.gz")
+                results['compressed'].append(file_path)
+        to_compress = pending
+
+    def compress_one(file_path: str):
+        try:
+            # See gzip_file for the compression settings; the original is
+            # removed once the .gz is complete
+            return gzip_file(file_path), None
+        except Exception as e:
+            return None, e
+
+    # Files are independent and zlib releases the GIL while compressing,
+    # so they are compressed on a thread pool
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        outcomes = executor.map(compress_one, to_compress)
+        for file_path, (gz_path, error) in zip(to_compress, outcomes):
+            if error is None:
+                logger.debug(f"Compressed: {file_path} -> {gz_path}")
+                results['compressed'].append(file_path)
+            else:
+                error_msg = f"Error compressing {file_path}: {error}"
+                logger.error(error_msg)
+                results['errors'].append(error_msg)
+
+    # Per-file lines are DEBUG only; one summary line is logged at INFO
+    logger.info(f"DWI compression: {len(results['compressed'])} compressed, "
+                f"{len(results['already_compressed'])} already compressed, "
+                f"{len(results['errors'])} errors")
     return results
 
 def update_csv_file(csv_file: str) -> Dict[str, int]:
     """
-    Update CSV file with final metadata.
+    Update CSV file with final metadata. The file is only rewritten when
+    rows were actually updated.
     
     Parameters:
     csv_file (str): Path to CSV file
@@ -74,18 +114,23 @@ def update_csv_file(csv_file: str) -> Dict[str, int]:
     }
     
     try:
-        df = pd.read_csv(csv_file)
+        df = pd.read_csv(csv_file, engine=CSV_ENGINE)
         stats['total_rows'] = len(df)
         
         # Count DWI rows
-        dwi_mask = df['image_file'].str.contains('dwi|dti', case=False, na=False)
+        dwi_mask = df['image_file'].str.contains(DWI_FILE_PATTERN, na=False)
         stats['dwi_rows'] = dwi_mask.sum()
         
         # Add any final metadata updates here if needed
         # For example, update file paths, add upload status, etc.
+        # Count them in stats['updated_rows']; the file is only rewritten
+        # when something changed
         
-        df.to_csv(csv_file, index=False)
-        logger.info(f"Updated CSV file: {csv_file}")
+        if stats['updated_rows']:
+            df.to_csv(csv_file, index=False)
+            logger.info(f"Updated CSV file: {csv_file}")
+        else:
+            logger.info(f"CSV unchanged, skipping write: {csv_file}")
         
     except Exception as e:
         logger.error(f"Error updating CSV file: {e}")
@@ -142,13 +187,14 @@ def main(config: Config):
     if 'error' in csv_stats:
         print(f"✗ Error updating CSV: {csv_stats['error']}")
     else:
-        print(f"✓ Updated CSV file with {csv_stats['total_rows']} total rows")
+        print(f"✓ Checked CSV file with {csv_stats['total_rows']} total rows "
+              f"({csv_stats['updated_rows']} updated)")
         print(f"  • {csv_stats['dwi_rows']} DWI/DTI entries")
         print(f"  • Located in: {config.csv_files.final_csv}\n")
 
     print("=== Pipeline Finalization Complete! ===")
     print(f"✓ Processed {len(dwi_results['compressed']) + len(dwi_results['already_compressed'])} DWI files total")
-    print(f"✓ Updated CSV file: {config.csv_files.final_csv}")
+    print(f"✓ Finalized CSV file: {config.csv_files.final_csv}")
     if dwi_results['errors']:
         print(f"✗ {len(dwi_results['errors'])} errors occurred - check logs for details\n")
     else:
@@ -2,26 +2,29 @@
 # main.py
 
 import argparse
+import importlib
 import sys
 import os
-from pathlib import Path
-from .utils.config import ConfigManager
+
+# Sub-command -> (module implementing it, [(CLI attribute, config section, config key)])
+COMMANDS = {
+    "convert-and-organize": ("convert_and_organize", [
+        ("dicom_dir", "paths", "dicom_dir"),
+        ("bids_dir", "paths", "bids_dir"),
+    ]),
+    "metadata-enrichment": ("metadata_enrichment", [
+        ("input_csv", "csv_files", "skeleton_csv"),
+        ("old_bids_dir", "paths", "bids_dir"),
+        ("new_bids_dir", "paths", "bids_dir"),
+        ("t2_json_map", "csv_files", "json_map_csv"),
+    ]),
+    "finalize-pipeline": ("finalize_pipeline", [
+        ("bids_dir", "paths", "bids_dir"),
+        ("csv_path", "csv_files", "final_csv"),
+    ]),
+}
 
 def main():
-    # Initialize config manager
-    config_manager = ConfigManager()
-    config = config_manager.get_config()
-    
-    # Create output directories
-    output_dirs = [
-        config.paths.bids_dir,
-        config.paths.log_dir,
-        os.path.dirname(config.csv_files.final_csv)
-    ]
-    
-    for dir_path in output_dirs:
-        Path(dir_path).mkdir(parents=True, exist_ok=True)
-    
     parser = argparse.ArgumentParser(
         description="""DICOM to BIDS Pipeline
 =====================
@@ -84,8 +87,10 @@ Output:
 - JSON sidecar files
 - Logs in outputs/log/dicom_to_bids.log""",
         formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser_convert.add_argument('--dicom-dir', help='Override DICOM directory from config')
-    parser_convert.add_argument('--bids-dir', help='Override BIDS directory from config')
+    parser_convert.add_argument('--dicom-dir', default=argparse.SUPPRESS,
+                                help='Override DICOM directory from config')
+    parser_convert.add_argument('--bids-dir', default=argparse.SUPPRESS,
+                                help='Override BIDS directory from config')
     
     # Subcommand: metadata-enrichment
     parser_meta = subparsers.add_parser("metadata-enrichment", 
@@ -106,10 +111,14 @@ Output:
 - Copied NIfTI files
 - Logs in outputs/log/metadata_enrichment.log""",
         formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser_meta.add_argument('--input-csv', help='Override input CSV from config')
-    parser_meta.add_argument('--old-bids-dir', help='Override old BIDS directory from config')
-    parser_meta.add_argument('--new-bids-dir', help='Override new BIDS directory from config')
-    parser_meta.add_argument('--t2-json-map', help='Override T2 JSON mapping file from config')
+    parser_meta.add_argument('--input-csv', default=argparse.SUPPRESS,
+                             help='Override input CSV from config')
+    parser_meta.add_argument('--old-bids-dir', default=argparse.SUPPRESS,
+                             help='Override old BIDS directory from config')
+    parser_meta.add_argument('--new-bids-dir', default=argparse.SUPPRESS,
+                             help='Override new BIDS directory from config')
+    parser_meta.add_argument('--t2-json-map', default=argparse.SUPPRESS,
+                             help='Override T2 JSON mapping file from config')
 
     # Subcommand: finalize-pipeline
     parser_final = subparsers.add_parser("finalize-pipeline", 
@@ -128,64 +137,54 @@ Output:
 - Updated CSV with zip file references
 - Logs in outputs/log/finalize_upload.log""",
         formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser_final.add_argument('--bids-dir', help='Override BIDS directory from config')
-    parser_final.add_argument('--csv-path', help='Override CSV metadata file from config')
+    parser_final.add_argument('--bids-dir', default=argparse.SUPPRESS,
+                              help='Override BIDS directory from config')
+    parser_final.add_argument('--csv-path', default=argparse.SUPPRESS,
+                              help='Override CSV metadata file from config')
 
     # Parse CLI
     args = parser.parse_args()
 
-    # Update config with command line arguments if provided
-    if args.config != 'config.yaml':
-        config_manager = ConfigManager(args.config)
-        config = config_manager.get_config()
-
-    # Handle command-specific overrides
-    if args.command == "convert-and-organize":
-        updates = {}
-        if args.dicom_dir:
-            updates['paths'] = {'dicom_dir': args.dicom_dir}
-        if args.bids_dir:
-            updates['paths'] = {'bids_dir': args.bids_dir}
-        if updates:
-            config_manager.update_config(updates)
-            config = config_manager.get_config()
-        
-        from .convert_and_organize import main as convert_main
-        convert_main(config)
-
-    elif args.command == "metadata-enrichment":
-        updates = {}
-        if args.input_csv:
-            updates['csv_files'] = {'skeleton_csv': args.input_csv}
-        if args.old_bids_dir:
-            updates['paths'] = {'bids_dir': args.old_bids_dir}
-        if args.new_bids_dir:
-            updates['paths'] = {'bids_dir': args.new_bids_dir}
-        if args.t2_json_map:
-            updates['csv_files'] = {'json_map_csv': args.t2_json_map}
-        if updates:
-            config_manager.update_config(updates)
-            config = config_manager.get_config()
-        
-        from .metadata_enrichment import main as meta_main
-        meta_main(config)
-
-    elif args.command == "finalize-pipeline":
-        updates = {}
-        if args.bids_dir:
-            updates['paths'] = {'bids_dir': args.bids_dir}
-        if args.csv_path:
-            updates['csv_files'] = {'final_csv': args.csv_path}
-        if updates:
-            config_manager.update_config(updates)
-            config = config_manager.get_config()
-        
-        from .finalize_pipeline import main as finalize_main
-        finalize_main(config)
-
-    else:
+    # Help and a missing sub-command need neither the config nor the
+    # output directories
+    if args.command is None:
         parser.print_help()
         sys.exit(1)
 
+    # Initialize config manager once, from --config (default config.yaml);
+    # imported here so the help path skips yaml
+    from .utils.config import ConfigManager
+    config_manager = ConfigManager(args.config)
+    config = config_manager.get_config()
+
+    # Create output directories
+    output_dirs = [
+        config.paths.bids_dir,
+        config.paths.log_dir,
+        os.path.dirname(config.csv_files.final_csv)
+    ]
+    
+    # Usually they already exist, so check before asking for a mkdir
+    for dir_path in output_dirs:
+        if dir_path and not os.path.isdir(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+
+    # Apply command-specific overrides, merged per config section
+    module_name, overrides = COMMANDS[args.command]
+    # Override options default to SUPPRESS, so only those actually given
+    # appear in the namespace
+    provided = vars(args)
+    updates = {}
+    for attr, section, key in overrides:
+        if attr in provided:
+            updates.setdefault(section, {})[key] = provided[attr]
+    if updates:
+        config_manager.update_config(updates)
+        config = config_manager.get_config()
+
+    # Import only the module for the chosen step
+    command_main = importlib.import_module(f".{module_name}", __package__).main
+    command_main(config)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
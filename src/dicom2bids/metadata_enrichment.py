@@ -6,63 +6,78 @@ warnings.filterwarnings('ignore', category=FutureWarning, module='pandas')
 
 import os
 import sys
-import shutil   # for file copying (instead of os.system('cp ...'))
+import functools
 import logging
 import pandas as pd
 import json
 import nibabel as nib
 from datetime import date, datetime
 from pathlib import Path
+from typing import Dict, FrozenSet, Optional, Set
+from concurrent.futures import ThreadPoolExecutor
 from .utils.config import Config
 from .utils import get_output_path, setup_logging, setup_excluded_scans_logger
 from .utils.config import ConfigManager
+from .convert_and_organize import copy_file
+
+try:
+    import orjson  # optional: faster sidecar parsing
+except ImportError:
+    orjson = None
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# (scan_type, image_description) rows produced for every subject
+SCAN_TYPES = (
+    ("MR structural (T2)", "T2_axial"),
+    ("MR structural (T2)", "T2_coronal"),
+    ("MR structural (T2)", "T2_sagittal"),
+    ("MR diffusion", "dwi b500_1000"),
+    ("fMRI", "bold, resting"),
+)
+
+# Enrichment columns with few distinct values across the expanded rows
+REPEATED_COLUMNS = (
+    "src_subject_id", "scan_object", "image_file_format", "procdate",
+    "scan_type", "image_description",
+)
+
+# Session subdirectory holding each scan type
+SCAN_SUBDIRS = {
+    "MR structural (T2)": ("anat", "T2"),
+    "MR diffusion": ("dwi",),
+    "fMRI": ("fmri",),
+}
+
+# Threads for the copies and sidecar reads: I/O bound, so a few more than
+# there are CPUs (the concurrent.futures default for thread pools)
+IO_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# Sidecar files copied along with the selected .nii.gz
+SIDECAR_EXTENSIONS = (".json", ".bvec", ".bval")
+
+# Which .nii.gz files a scan description selects, checked in order:
+# (keyword in the lowercased description, substrings required, substrings excluded)
+NII_SELECTORS = (
+    ("axial", ("FETUS", "AX"), ("Eq",)),
+    ("coronal", ("FETUS", "COR"), ("Eq",)),
+    ("sagittal", ("FETUS", "SAG"), ("Eq",)),
+    ("bold", ("bold",), ()),
+    ("1000", ("b500",), ()),
+)
+
 def expand_for_scan_types(df: pd.DataFrame) -> pd.DataFrame:
     """
     Expand each row for multiple scan types: T2 axial, coronal, sagittal, DWI, fMRI, etc.
     This logic comes from the first notebook (01_constants_to_csv).
+
+    Every row is repeated once per entry of SCAN_TYPES with a single cross
+    join, keeping the rows of each subject together in SCAN_TYPES order.
     """
     logger.info("Expanding CSV rows for multiple scan types...")
-    expanded_rows = []
-
-    for _, row in df.iterrows():
-        # Create a copy of the entire row as a dictionary
-        row_dict = row.to_dict()
-
-        # T2 Axial
-        row_ax = row_dict.copy()
-        row_ax["scan_type"] = "MR structural (T2)"
-        row_ax["image_description"] = "T2_axial"
-        expanded_rows.append(row_ax)
-
-        # T2 Coronal
-        row_cor = row_dict.copy()
-        row_cor["scan_type"] = "MR structural (T2)"
-        row_cor["image_description"] = "T2_coronal"
-        expanded_rows.append(row_cor)
-
-        # T2 Sagittal
-        row_sag = row_dict.copy()
-        row_sag["scan_type"] = "MR structural (T2)"
-        row_sag["image_description"] = "T2_sagittal"
-        expanded_rows.append(row_sag)
-
-        # DWI
-        row_dwi = row_dict.copy()
-        row_dwi["scan_type"] = "MR diffusion"
-        row_dwi["image_description"] = "dwi b500_1000"
-        expanded_rows.append(row_dwi)
-
-        # fMRI
-        row_fmri = row_dict.copy()
-        row_fmri["scan_type"] = "fMRI"
-        row_fmri["image_description"] = "bold, resting"
-        expanded_rows.append(row_fmri)
-
-    df_expanded = pd.DataFrame(expanded_rows)
+    scan_table = pd.DataFrame(list(SCAN_TYPES), columns=["scan_type", "image_description"])
+    df_expanded = df.drop(columns=scan_table.columns, errors="ignore").merge(scan_table, how="cross")
     logger.info(f"Expanded from {len(df)} rows to {len(df_expanded)} rows.")
     return df_expanded
 
@@ -75,39 +90,117 @@ def convert_subject_id_to_dir(subject_id: str) -> str:
     return subject_id.replace('-', '_')
 
 
-def copy_nii_and_sidecars(row, old_bids_dir: str, new_bids_dir: str) -> tuple[str, str]:
+@functools.lru_cache(maxsize=None)
+def nii_sizes(dir_path: str) -> Dict[str, int]:
+    """
+    Sizes of the .nii.gz files in `dir_path`, from one scandir pass.
+
+    Cached for the run since the rows of a subject share their scan
+    directories (three T2 rows all read anat/T2); main() clears the cache.
+    """
+    with os.scandir(dir_path) as it:
+        return {entry.name: entry.stat().st_size for entry in it if entry.name.endswith('.nii.gz')}
+
+
+@functools.lru_cache(maxsize=None)
+def sidecar_names(dir_path: str) -> FrozenSet[str]:
+    """
+    Names of the .json/.bvec/.bval files in `dir_path`, from one scandir pass.
+
+    Cached alongside nii_sizes so sidecars are looked up without a stat each.
+    """
+    with os.scandir(dir_path) as it:
+        return frozenset(entry.name for entry in it if entry.name.endswith(SIDECAR_EXTENSIONS))
+
+
+def index_scan_dirs(bids_dir: str) -> Set[str]:
+    """
+    Collect every subject ses-01 directory under `bids_dir` and the scan
+    subdirectories (SCAN_SUBDIRS) present in it, as the same joined paths
+    copy_nii_and_sidecars builds, so rows check them without a stat each.
+
+    Lookups in the index are exact, so a subject directory whose name differs
+    from the converted subject ID only in case is reported missing even on a
+    case-insensitive filesystem. A missing `bids_dir` gives an empty index,
+    so every row is reported as a missing subject directory.
+    """
+    existing = set()
+    try:
+        subjects = os.scandir(bids_dir)
+    except FileNotFoundError:
+        logger.warning(f"BIDS directory not found: {bids_dir}; every scan will be reported missing")
+        return existing
+    with subjects:
+        for subject in subjects:
+            if not subject.is_dir():
+                continue
+            session = os.path.join(bids_dir, subject.name, "ses-01")
+            if not os.path.isdir(session):
+                continue
+            existing.add(session)
+            for parts in SCAN_SUBDIRS.values():
+                scan_dir = os.path.join(session, *parts)
+                if os.path.isdir(scan_dir):
+                    existing.add(scan_dir)
+    return existing
+
+
+def pick_largest_nii(dir_path: str, desc_lower: str) -> Optional[str]:
+    """
+    Pick the largest .nii.gz in `dir_path` matching the first NII_SELECTORS
+    rule whose keyword appears in `desc_lower`.
+
+    Returns:
+    Optional[str]: File name, or None if nothing matches
     """
-    Given a row with subject ID and scan type, find the largest matching .nii.gz
+    for keyword, required, excluded in NII_SELECTORS:
+        if keyword in desc_lower:
+            break
+    else:
+        return None
+
+    largest_file, largest_size = None, -1
+    for name, size in nii_sizes(dir_path).items():
+        if (size > largest_size and all(r in name for r in required)
+                and not any(x in name for x in excluded)):
+            largest_file, largest_size = name, size
+    return largest_file
+
+
+def copy_nii_and_sidecars(row, old_bids_dir: str, new_bids_dir: str,
+                          existing_dirs: Optional[Set[str]] = None) -> tuple[str, str]:
+    """
+    Given a row (a namedtuple from DataFrame.itertuples) with subject ID and
+    scan type, find the largest matching .nii.gz
     in the OLD BIDS directory and copy it (plus .json, .bvec, .bval)
     to a mirrored path under NEW BIDS dir.
     Returns a tuple of (new_nii_path, reason) where reason is None if successful,
     or a string explaining why the file wasn't found/copied.
+    `existing_dirs` (from index_scan_dirs) replaces the directory existence
+    checks when given.
     """
-    subject_id = row["src_subject_id"]
+    dir_exists = os.path.exists if existing_dirs is None else existing_dirs.__contains__
+    subject_id = row.src_subject_id
     if not subject_id:
         return None, "No subject ID found in row"
 
     # Convert subject ID to directory format
     subject_dir = convert_subject_id_to_dir(subject_id)
-    logger.info(f"Converted subject ID {subject_id} to directory format {subject_dir}")
+    logger.debug("Converted subject ID %s to directory format %s", subject_id, subject_dir)
 
-    scan_type = row.get("scan_type", "")
-    img_description = row.get("image_description", "")
+    scan_type = getattr(row, "scan_type", "")
+    img_description = getattr(row, "image_description", "")
 
     # Construct path to subject's directory
     old_dir_path = os.path.join(old_bids_dir, subject_dir, "ses-01")
-    if not os.path.exists(old_dir_path):
+    if not dir_exists(old_dir_path):
         return None, f"Missing Subject Directory: {old_dir_path}"
 
     # Decide subdirectory by scan type
-    if scan_type == "MR structural (T2)":
-        old_dir_path = os.path.join(old_dir_path, "anat", "T2")
-    elif scan_type == "MR diffusion":
-        old_dir_path = os.path.join(old_dir_path, "dwi")
-    elif scan_type == "fMRI":
-        old_dir_path = os.path.join(old_dir_path, "fmri")
-
-    if not os.path.exists(old_dir_path):
+    if scan_type in SCAN_SUBDIRS:
+        old_dir_path = os.path.join(old_dir_path, *SCAN_SUBDIRS[scan_type])
+
+    if not dir_exists(old_dir_path):
         return None, f"Missing Scan Type Directory: {old_dir_path}"
 
     # Build new_dir by taking the relative path from old_bids_dir
@@ -115,37 +208,11 @@ def copy_nii_and_sidecars(row, old_bids_dir: str, new_bids_dir: str) -> tuple[st
     new_dir_path = os.path.join(new_bids_dir, rel_path)
     os.makedirs(new_dir_path, exist_ok=True)
 
-    # Gather .nii.gz files
-    files = os.listdir(old_dir_path)
-    nii_candidates = []
-    desc_lower = img_description.lower()
-
-    # Example logic for T2 subtypes
-    if 'axial' in desc_lower:
-        nii_candidates = [
-            f for f in files
-            if f.endswith('.nii.gz') and 'FETUS' in f and 'AX' in f and 'Eq' not in f
-        ]
-    elif 'coronal' in desc_lower:
-        nii_candidates = [
-            f for f in files
-            if f.endswith('.nii.gz') and 'FETUS' in f and 'COR' in f and 'Eq' not in f
-        ]
-    elif 'sagittal' in desc_lower:
-        nii_candidates = [
-            f for f in files
-            if f.endswith('.nii.gz') and 'FETUS' in f and 'SAG' in f and 'Eq' not in f
-        ]
-    elif 'bold' in desc_lower:
-        nii_candidates = [f for f in files if f.endswith('.nii.gz') and 'bold' in f]
-    elif '1000' in desc_lower:
-        nii_candidates = [f for f in files if f.endswith('.nii.gz') and 'b500' in f]
-
-    if not nii_candidates:
+    # Pick the largest matching .nii.gz
+    largest_file = pick_largest_nii(old_dir_path, img_description.lower())
+    if largest_file is None:
         return None, f"No matching .nii.gz files found for {img_description} in {old_dir_path}"
 
-    # Pick largest file
-    largest_file = max(nii_candidates, key=lambda x: os.path.getsize(os.path.join(old_dir_path, x)))
     old_largest_file_path = os.path.join(old_dir_path, largest_file)
     new_largest_file_path = os.path.join(new_dir_path, largest_file)
 
@@ -153,48 +220,56 @@ def copy_nii_and_sidecars(row, old_bids_dir: str, new_bids_dir: str) -> tuple[st
     if os.path.abspath(old_largest_file_path) == os.path.abspath(new_largest_file_path):
         return old_largest_file_path, None
 
-    # Copy the NIfTI and sidecars
+    # Sidecars share the NIfTI name minus its ".nii.gz" suffix
+    base = largest_file[:-len(".nii.gz")]
+    present = sidecar_names(old_dir_path)
+    sidecars = [base + ext for ext in SIDECAR_EXTENSIONS if base + ext in present]
+
+    # Copy the NIfTI and sidecars in one pass
     try:
-        shutil.copy2(old_largest_file_path, new_largest_file_path)
-        
-        # Copy .json
-        old_json_path = old_largest_file_path.replace('.nii.gz', '.json')
-        new_json_path = new_largest_file_path.replace('.nii.gz', '.json')
-        if os.path.exists(old_json_path):
-            shutil.copy2(old_json_path, new_json_path)
-
-        # Copy bvec/bval
-        old_bvec = old_largest_file_path.replace('.nii.gz', '.bvec')
-        old_bval = old_largest_file_path.replace('.nii.gz', '.bval')
-        new_bvec = new_largest_file_path.replace('.nii.gz', '.bvec')
-        new_bval = new_largest_file_path.replace('.nii.gz', '.bval')
-        if os.path.exists(old_bvec):
-            shutil.copy2(old_bvec, new_bvec)
-        if os.path.exists(old_bval):
-            shutil.copy2(old_bval, new_bval)
+        for name in [largest_file] + sidecars:
+            copy_file(os.path.join(old_dir_path, name), os.path.join(new_dir_path, name))
 
         return new_largest_file_path, None
     except Exception as e:
         return None, f"Error copying files: {str(e)}"
 
 
-def merge_json_data(json_map_dict, image_file_path, df, row_idx):
+@functools.lru_cache(maxsize=8)
+def load_json_map(path: str, mtime: float) -> Dict[str, str]:
+    """
+    Parse the JSON map CSV into a {json_name: csv_name} dict.
+
+    Cached on (path, mtime) so repeated runs in one process skip the
+    pandas parse until the file changes.
+    """
+    # Only the two mapping columns are parsed
+    t2_mapping = pd.read_csv(path, usecols=['json_name', 'csv_name'], dtype=str)
+    return dict(zip(t2_mapping['json_name'].to_numpy(), t2_mapping['csv_name'].to_numpy()))
+
+
+def merge_json_data(json_map_dict, image_file_path) -> dict:
     """
     Given the newly-copied .nii.gz path and the mapping dictionary,
-    read the matching .json sidecar, and copy values into the df row.
+    read the matching .json sidecar and return the mapped values for the row.
     This logic is from the second notebook (02_copy_to_new_dir_populate_csv).
+
+    Returns:
+    dict: CSV column -> value (as str) for every mapped key in the sidecar
     """
+    values = {}
     if not image_file_path or pd.isna(image_file_path):
-        return
+        return values
 
-    json_file_path = image_file_path.replace('.nii.gz', '.json')
+    json_file_path = image_file_path[:-len(".nii.gz")] + ".json"
     if not os.path.exists(json_file_path):
         logger.warning(f"No JSON found at {json_file_path}")
-        return
+        return values
 
     try:
-        with open(json_file_path, 'r') as f:
-            json_data = json.load(f)
+        with open(json_file_path, 'rb') as f:
+            raw = f.read()
+        json_data = orjson.loads(raw) if orjson is not None else json.loads(raw)
 
         for json_key, csv_col in json_map_dict.items():
             if json_key in json_data:
@@ -202,10 +277,11 @@ def merge_json_data(json_map_dict, image_file_path, df, row_idx):
                 if isinstance(val, list):
                     val = str(val)  # convert list to string
                 # Convert to string to avoid dtype issues
-                df.at[row_idx, csv_col] = str(val)
+                values[csv_col] = str(val)
 
     except Exception as e:
         logger.warning(f"Error parsing {json_file_path}: {e}")
+    return values
 
 
 def setup_summary_logger(config):
@@ -283,47 +359,71 @@ def main(config: Config):
     # Ensure all columns in expanded df are string type
     for col in df_expanded.columns:
         df_expanded[col] = df_expanded[col].astype(str)
+    # Columns holding a handful of values repeated on every row are stored
+    # as categories (the CSV output is unchanged)
+    for col in REPEATED_COLUMNS:
+        if col in df_expanded:
+            df_expanded[col] = df_expanded[col].astype("category")
     print(f"✓ Expanded from {len(df)} to {len(df_expanded)} rows\n")
 
     print("Step 4/6: Loading JSON mapping...")
     # 3. Load T2 JSON mapping (which columns to pull from sidecar)
     logger.info(f"Loading T2 JSON mapping from: {t2_json_map}")
-    t2_mapping = pd.read_csv(t2_json_map)
-    logger.info(f"Loaded {len(t2_mapping)} entries in JSON map.")
-    json_map_dict = dict(zip(t2_mapping['json_name'], t2_mapping['csv_name']))
-    print(f"✓ Loaded {len(t2_mapping)} JSON mapping entries\n")
+    json_map_dict = load_json_map(t2_json_map, os.path.getmtime(t2_json_map))
+    logger.info(f"Loaded {len(json_map_dict)} entries in JSON map.")
+    print(f"✓ Loaded {len(json_map_dict)} JSON mapping entries\n")
 
     print("Step 5/6: Processing files...")
     # 4. For each row, copy NIfTI & sidecars, then read JSON into the CSV
-    rows_to_drop = []
     total_rows = len(df_expanded)
     processed_count = 0
+
+    # Results are collected per column and assigned once after the loop;
+    # json_values keeps columns in the order they are first seen
+    image_files = [None] * total_rows
+    json_values = {}
+
+    # Rows are independent and the copies and sidecar reads are I/O-bound,
+    # so both run on a thread pool; results come back in row order
+    rows = list(df_expanded.itertuples(index=True))
+    nii_sizes.cache_clear()
+    sidecar_names.cache_clear()
+    existing_dirs = index_scan_dirs(old_bids_dir)
+    with ThreadPoolExecutor(max_workers=IO_WORKERS) as executor:
+        outcomes = list(executor.map(
+            lambda row: copy_nii_and_sidecars(row, old_bids_dir, new_bids_dir, existing_dirs),
+            rows))
+        sidecar_values = list(executor.map(
+            functools.partial(merge_json_data, json_map_dict),
+            [new_nii_path for new_nii_path, _ in outcomes]))
     
-    for idx, row in df_expanded.iterrows():
-        logger.info(f"Processing row {idx+1}/{len(df_expanded)}...")
-        logger.debug(f"Row data: {row.to_dict()}")
-        new_nii_path, reason = copy_nii_and_sidecars(row, old_bids_dir, new_bids_dir)
+    for pos, (row, (new_nii_path, reason)) in enumerate(zip(rows, outcomes)):
+        idx = row.Index
+        logger.debug("Processing row %d/%d", idx + 1, total_rows)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Row data: %s", row._asdict())
+        if (pos + 1) % 100 == 0:
+            logger.info("Processed %d/%d rows", pos + 1, total_rows)
         
         # Store the final file path in the CSV, so we can see where it actually lives
         if new_nii_path:
-            df_expanded.at[idx, "image_file"] = str(new_nii_path)  # Convert to string to avoid dtype issues
-            merge_json_data(json_map_dict, new_nii_path, df_expanded, idx)
+            image_files[pos] = str(new_nii_path)  # Convert to string to avoid dtype issues
+            for csv_col, val in sidecar_values[pos].items():
+                json_values.setdefault(csv_col, {})[pos] = val
             processed_count += 1
         else:
-            df_expanded.at[idx, "image_file"] = None
             # Enhanced logging for excluded scans
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             excluded_scans_logger.info(f"""
 === Excluded Scan Report ===
 Timestamp: {timestamp}
-Subject: {row['src_subject_id']}
-Scan Type: {row.get('scan_type', 'unknown')}
-Description: {row.get('image_description', 'unknown')}
+Subject: {row.src_subject_id}
+Scan Type: {getattr(row, 'scan_type', 'unknown')}
+Description: {getattr(row, 'image_description', 'unknown')}
 Category: {reason.split(':')[0] if ':' in reason else 'Unknown'}
 Reason: {reason}
-Searched Path: {os.path.join(old_bids_dir, convert_subject_id_to_dir(row['src_subject_id']), 'ses-01')}
+Searched Path: {os.path.join(old_bids_dir, convert_subject_id_to_dir(row.src_subject_id), 'ses-01')}
 """)
-            rows_to_drop.append(idx)
         
         # Print progress
         progress = (idx + 1) / total_rows * 100
@@ -331,25 +431,42 @@ Searched Path: {os.path.join(old_bids_dir, convert_subject_id_to_dir(row['src_su
     
     print("\n✓ Processed files complete\n")
 
-    # Drop rows with missing files
-    if rows_to_drop:
-        logger.info(f"Dropping {len(rows_to_drop)} rows with missing files")
-        df_expanded = df_expanded.drop(rows_to_drop)
+    df_expanded["image_file"] = image_files
+    for csv_col, by_pos in json_values.items():
+        # Cells without a sidecar value keep what the skeleton CSV had
+        column = df_expanded[csv_col].tolist() if csv_col in df_expanded else [None] * total_rows
+        for pos, val in by_pos.items():
+            column[pos] = val
+        df_expanded[csv_col] = column
+
+    # Drop rows with missing files with one boolean mask
+    keep = df_expanded["image_file"].notna().to_numpy()
+    if not keep.all():
+        logger.info(f"Dropping {int((~keep).sum())} rows with missing files")
+        df_expanded = df_expanded[keep].reset_index(drop=True)
         logger.info(f"Remaining rows after dropping missing files: {len(df_expanded)}")
 
     print("Step 6/6: Calculating NIfTI statistics...")
-    from .nifti_calculations import process_nifti_file
+    from .nifti_calculations import assign_metadata_columns, process_nifti_file
     nifti_stats_count = 0
     
-    for idx, row in df_expanded.iterrows():
-        if pd.notna(row['image_file']):
-            metadata = process_nifti_file(row['image_file'])
-            if metadata:
-                for key, value in metadata.items():
-                    df_expanded.at[idx, key] = str(value)
-                nifti_stats_count += 1
-            else:
-                logger.warning(f"Failed to process NIfTI file: {row['image_file']}")
+    # The copied files are read on a thread pool (gzip and numpy release the
+    # GIL, and worker log records reach the parent's logging queue); results
+    # come back in row order
+    has_image = df_expanded['image_file'].notna()
+    image_rows = df_expanded.index[has_image]
+    image_paths = df_expanded.loc[has_image, 'image_file'].tolist()
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = list(executor.map(process_nifti_file, image_paths))
+
+    for image_file, metadata in zip(image_paths, results):
+        if metadata:
+            nifti_stats_count += 1
+        else:
+            logger.warning(f"Failed to process NIfTI file: {image_file}")
+    df_expanded = assign_metadata_columns(
+        df_expanded, image_rows,
+        [{key: str(value) for key, value in metadata.items()} if metadata else None for metadata in results])
     
     print(f"✓ Calculated statistics for {nifti_stats_count} NIfTI files\n")
 
@@ -357,63 +474,55 @@ Searched Path: {os.path.join(old_bids_dir, convert_subject_id_to_dir(row['src_su
     print(f"Writing final enriched CSV to: {output_csv}")
     df_expanded.to_csv(output_csv, index=False)
     
-    # Generate summary report
-    summary_logger.info("=== Metadata Enrichment Summary Report ===\n")
+    # Generate summary report; lines are collected and logged as one record
+    report = ["=== Metadata Enrichment Summary Report ===\n"]
     
     # Missing Subjects
-    summary_logger.info("Missing Subjects (not found in BIDS directory):")
+    report.append("Missing Subjects (not found in BIDS directory):")
     missing_subjects = set(df['src_subject_id'].unique()) - set(df_expanded['src_subject_id'].unique())
     for subject in sorted(missing_subjects):
-        summary_logger.info(f"  - {subject}")
-    summary_logger.info(f"\nTotal missing subjects: {len(missing_subjects)}\n")
+        report.append(f"  - {subject}")
+    report.append(f"\nTotal missing subjects: {len(missing_subjects)}\n")
     
     # Missing Scans for Existing Subjects
-    summary_logger.info("Missing Scans for Existing Subjects:")
-    missing_scans = {}
-    for idx, row in df_expanded.iterrows():
-        if pd.isna(row['image_file']):
-            subject = row['src_subject_id']
-            if subject not in missing_scans:
-                missing_scans[subject] = []
-            missing_scans[subject].append({
-                'scan_type': row['scan_type'],
-                'description': row['image_description'],
-                'reason': 'Scan not found in BIDS directory'
-            })
+    report.append("Missing Scans for Existing Subjects:")
+    has_file = df_expanded['image_file'].notna()
+    missing_scans = {
+        subject: group[['scan_type', 'image_description']].to_dict('records')
+        for subject, group in df_expanded[~has_file].groupby('src_subject_id', observed=True, sort=False)
+    }
     
     # Successfully Processed Files
-    summary_logger.info("\nSuccessfully Processed Files for Upload:")
-    processed_files = {}
-    for idx, row in df_expanded.iterrows():
-        if pd.notna(row['image_file']):
-            subject = row['src_subject_id']
-            if subject not in processed_files:
-                processed_files[subject] = []
-            processed_files[subject].append({
-                'scan_type': row['scan_type'],
-                'description': row['image_description'],
-                'file': os.path.basename(row['image_file'])
-            })
+    report.append("\nSuccessfully Processed Files for Upload:")
+    processed_files = {
+        subject: [
+            {'scan_type': scan_type, 'description': description, 'file': os.path.basename(image_file)}
+            for scan_type, description, image_file in zip(
+                group['scan_type'], group['image_description'], group['image_file'])
+        ]
+        for subject, group in df_expanded[has_file].groupby('src_subject_id', observed=True, sort=False)
+    }
     
     for subject in sorted(processed_files.keys()):
-        summary_logger.info(f"\nSubject: {subject}")
+        report.append(f"\nSubject: {subject}")
         for file_info in processed_files[subject]:
-            summary_logger.info(f"  - {file_info['scan_type']} ({file_info['description']})")
-            summary_logger.info(f"    File: {file_info['file']}")
+            report.append(f"  - {file_info['scan_type']} ({file_info['description']})")
+            report.append(f"    File: {file_info['file']}")
     
     # Summary Statistics
     total_subjects = len(df['src_subject_id'].unique())
     missing_subjects_count = len(missing_subjects)
     existing_subjects = total_subjects - missing_subjects_count
-    total_processed_files = sum(len(files) for files in processed_files.values())
+    total_processed_files = int(has_file.sum())
     
-    summary_logger.info(f"\nSummary Statistics:")
-    summary_logger.info(f"Total subjects in CSV: {total_subjects}")
-    summary_logger.info(f"Missing subjects: {missing_subjects_count}")
-    summary_logger.info(f"Existing subjects: {existing_subjects}")
-    summary_logger.info(f"Subjects with missing scans: {len(missing_scans)}")
-    summary_logger.info(f"Total files processed for upload: {total_processed_files}")
-    summary_logger.info(f"Files with NIfTI statistics: {nifti_stats_count}")
+    report.append("\nSummary Statistics:")
+    report.append(f"Total subjects in CSV: {total_subjects}")
+    report.append(f"Missing subjects: {missing_subjects_count}")
+    report.append(f"Existing subjects: {existing_subjects}")
+    report.append(f"Subjects with missing scans: {len(missing_scans)}")
+    report.append(f"Total files processed for upload: {total_processed_files}")
+    report.append(f"Files with NIfTI statistics: {nifti_stats_count}")
+    summary_logger.info("\n".join(report))
 
     print("\n=== Metadata Enrichment Complete! ===")
     print(f"✓ Successfully processed {processed_count} files")
@@ -11,12 +11,17 @@ import tempfile
 import zipfile
 from pathlib import Path
 from datetime import date
+from concurrent.futures import ThreadPoolExecutor
 from .utils import get_output_path
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
+# Voxel-index corners of the unit square (z = 0) and unit cube
+UNIT_CORNERS_2D = np.array([(i, j, 0) for i, j in np.ndindex((2, 2))], dtype=np.float64)
+UNIT_CORNERS_3D = np.array(list(np.ndindex((2, 2, 2))), dtype=np.float64)
+
 def get_nifti_metadata(file_path):
     """
     Extract key metadata from a NIfTI file.
@@ -116,26 +121,16 @@ def calculate_extent(img):
     dims = img.shape
     
     if len(dims) == 2:
-        corners = np.array(list(np.ndindex((2, 2))))
-        corners = corners * (np.array(dims[:2]) - 1)
-        corners = np.column_stack((corners, np.zeros(len(corners))))
+        corners = UNIT_CORNERS_2D * (np.array(dims[:2] + (1,)) - 1)
     else:
-        corners = np.array(list(np.ndindex((2, 2, 2))))
-        corners = corners * (np.array(dims[:3]) - 1)
+        corners = UNIT_CORNERS_3D * (np.array(dims[:3]) - 1)
     
     world_corners = nib.affines.apply_affine(img.affine, corners)
+    spans = np.ptp(world_corners, axis=0)
 
-    if len(dims) == 2:
-        extent = {
-            'x': float(np.max(world_corners[:, 0]) - np.min(world_corners[:, 0])),
-            'y': float(np.max(world_corners[:, 1]) - np.min(world_corners[:, 1]))
-        }
-    else:
-        extent = {
-            'x': float(np.max(world_corners[:, 0]) - np.min(world_corners[:, 0])),
-            'y': float(np.max(world_corners[:, 1]) - np.min(world_corners[:, 1])),
-            'z': float(np.max(world_corners[:, 2]) - np.min(world_corners[:, 2]))
-        }
+    extent = {'x': float(spans[0]), 'y': float(spans[1])}
+    if len(dims) != 2:
+        extent['z'] = float(spans[2])
     
     if len(dims) == 4:
         extent['t'] = float(dims[3])
@@ -181,6 +176,29 @@ def process_nifti_file(file_path):
         logger.error(f"Error processing file {file_path}: {str(e)}")
         return None
 
+def assign_metadata_columns(df, index, metadata_rows):
+    """
+    Write per-row metadata dicts into a DataFrame one column at a time.
+    
+    Parameters:
+    df (pd.DataFrame): Frame to update
+    index (pd.Index): Labels of the rows the metadata belongs to, in order
+    metadata_rows (list): Metadata dict (or None) per label in `index`
+    
+    Returns:
+    pd.DataFrame: `df` with a column per metadata key; rows without a value
+    for a key keep what they had (or NaN for a new column). Values written
+    into an existing column are cast to its dtype, as per-cell writes would be
+    """
+    meta_df = pd.DataFrame([metadata or {} for metadata in metadata_rows], index=index, dtype=object)
+    for key in meta_df.columns:
+        values = meta_df[key].dropna()
+        if key in df.columns:
+            df.loc[values.index, key] = values.infer_objects()
+        else:
+            df[key] = values.reindex(df.index)
+    return df
+
 def main(input_csv: str = None):
     """
     Main function to process NIfTI files and extract metadata.
@@ -201,23 +219,26 @@ def main(input_csv: str = None):
     logger.info(f"Reading input CSV: {input_csv}")
     df = pd.read_csv(input_csv)
     
-    # Process each row
-    for idx, row in df.iterrows():
-        logger.info(f"Processing row {idx+1}/{len(df)}")
-        file_path = row['image_file']
-        
-        metadata = process_nifti_file(file_path)
-        if metadata:
-            for key, value in metadata.items():
-                if key not in df.columns:
-                    df[key] = None
-                df.at[idx, key] = value
-    
-    # Convert dates to datetime and format as MM/DD/YYYY
-    if 'interview_date' in df.columns:
-        df['interview_date'] = pd.to_datetime(df['interview_date']).dt.strftime('%m/%d/%Y')
-    if 'procdate' in df.columns:
-        df['procdate'] = pd.to_datetime(df['procdate']).dt.strftime('%m/%d/%Y')
+    # Files are read on a thread pool (gzip and numpy release the GIL, and
+    # worker log records reach this process's handlers); results come back
+    # in row order
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = list(executor.map(process_nifti_file, df['image_file']))
+
+    logger.info(f"Extracted metadata for {sum(1 for metadata in results if metadata)}/{len(df)} rows")
+    df = assign_metadata_columns(df, df.index, results)
+    
+    # Convert dates to datetime and format as MM/DD/YYYY; repeated strings are
+    # parsed once (cache=True) and unparseable ones are left blank
+    for col in ('interview_date', 'procdate'):
+        if col in df.columns:
+            dates = df[col]
+            if not pd.api.types.is_datetime64_any_dtype(dates):
+                dates = pd.to_datetime(dates, errors='coerce', cache=True)
+                invalid = int((dates.isna() & df[col].notna()).sum())
+                if invalid:
+                    logger.warning(f"{invalid} unparseable {col} values left blank")
+            df[col] = dates.dt.strftime('%m/%d/%Y')
     
     logger.info(f"Writing output CSV: {output_csv}")
     df.to_csv(output_csv, index=False)
@@ -2,12 +2,13 @@
 Utility functions for the dicom2bids package.
 """
 
-from .logging import setup_logging, setup_excluded_scans_logger
+from .logging import setup_logging, setup_excluded_scans_logger, stop_logging
 from .paths import get_output_dir, get_output_path
 
 __all__ = [
     'setup_logging',
     'setup_excluded_scans_logger',
+    'stop_logging',
     'get_output_dir',
     'get_output_path'
 ] 
\ No newline at end of file
@@ -2,31 +2,51 @@
 # config.py
 
 import os
-import yaml
+import sys
+import functools
 from pathlib import Path
 from typing import Dict, Any, Optional
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 
-@dataclass
+@functools.lru_cache(maxsize=None)
+def yaml_codecs():
+    """
+    Import yaml on first use, so importing the package does not pay for it.
+    
+    Returns:
+    tuple: (yaml module, loader, dumper), using libyaml's C loader/dumper
+    when PyYAML was built against it
+    """
+    import yaml
+    return (yaml,
+            getattr(yaml, "CSafeLoader", yaml.SafeLoader),
+            getattr(yaml, "CSafeDumper", yaml.SafeDumper))
+
+# Slotted config dataclasses on Pythons whose dataclass supports it (3.10+)
+DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+@dataclass(frozen=True, **DATACLASS_SLOTS)
 class PathsConfig:
     dicom_dir: str
     bids_dir: str
     log_dir: str
+    subject_prefix: str = ""
 
-@dataclass
+@dataclass(frozen=True, **DATACLASS_SLOTS)
 class CSVFilesConfig:
     skeleton_csv: str
     json_map_csv: str
     final_csv: str
 
-@dataclass
+@dataclass(frozen=True, **DATACLASS_SLOTS)
 class ProcessingConfig:
     run_json_check: bool
     check_sensitive_data: bool
     create_derivatives: bool
     compress_nifti: bool
+    link_mode: str = "hardlink"
 
-@dataclass
+@dataclass(frozen=True, **DATACLASS_SLOTS)
 class SessionConfig:
     enabled: bool
     format: str
@@ -35,52 +55,99 @@ class SessionConfig:
     auto_increment: bool
     session_map: Dict[str, int]
 
-@dataclass
+@dataclass(frozen=True, **DATACLASS_SLOTS)
 class LoggingConfig:
     level: str
     file: str
     session: SessionConfig
 
-@dataclass
+@dataclass(frozen=True, **DATACLASS_SLOTS)
 class Config:
     paths: PathsConfig
     csv_files: CSVFilesConfig
     processing: ProcessingConfig
     logging: LoggingConfig
 
+def _config_section(config_dict: Dict[str, Any], *keys: str) -> Dict[str, Any]:
+    """Return the mapping at `keys` in `config_dict`, or raise ValueError naming it."""
+    section = config_dict
+    for key in keys:
+        section = section.get(key) if isinstance(section, dict) else None
+    if not isinstance(section, dict):
+        raise ValueError(f"Config section '{'.'.join(keys)}' is missing or not a mapping")
+    return section
+
+def _build_section(cls, config_dict: Dict[str, Any], *keys: str):
+    """Construct `cls` from the section at `keys`, naming the section on bad or missing keys."""
+    try:
+        return cls(**_config_section(config_dict, *keys))
+    except TypeError as e:
+        raise ValueError(f"Invalid config section '{'.'.join(keys)}': {e}") from e
+
+def config_from_dict(config_dict: Dict[str, Any]) -> Config:
+    """
+    Validate a parsed configuration dict and convert it to dataclass objects.
+    
+    Raises:
+    ValueError: If a section is missing, is not a mapping, or has missing or
+    unknown keys; the message names the section
+    """
+    paths = _build_section(PathsConfig, config_dict, 'paths')
+    csv_files = _build_section(CSVFilesConfig, config_dict, 'csv_files')
+    processing = _build_section(ProcessingConfig, config_dict, 'processing')
+    session = _build_section(SessionConfig, config_dict, 'logging', 'session')
+    logging_section = _config_section(config_dict, 'logging')
+    try:
+        logging = LoggingConfig(
+            level=logging_section['level'],
+            file=logging_section['file'],
+            session=session
+        )
+    except KeyError as e:
+        raise ValueError(f"Invalid config section 'logging': missing key {e}") from e
+    
+    return Config(
+        paths=paths,
+        csv_files=csv_files,
+        processing=processing,
+        logging=logging
+    )
+
 class ConfigManager:
-    """Manages loading and validation of configuration from YAML file."""
+    """
+    Manages loading and validation of configuration from YAML file.
+    
+    There is one manager per config file in a process: constructing it again
+    with the same path (after os.path.abspath) returns the existing instance,
+    so the file is parsed once however many stages ask for it.
+    """
+    
+    _instances: Dict[str, "ConfigManager"] = {}
     
-    def __init__(self, config_path: str = "config.yaml"):
-        self.config_path = config_path
-        self.config: Optional[Config] = None
+    def __new__(cls, config_path: str = "config.yaml"):
+        key = os.path.abspath(config_path)
+        instance = cls._instances.get(key)
+        if instance is None:
+            instance = super().__new__(cls)
+            instance.config_path = config_path
+            instance.config: Optional[Config] = None
+            cls._instances[key] = instance
+        return instance
     
     def load_config(self) -> Config:
         """Load and validate configuration from YAML file."""
-        if not os.path.exists(self.config_path):
-            raise FileNotFoundError(f"Config file not found: {self.config_path}")
-        
-        with open(self.config_path, 'r') as f:
-            config_dict = yaml.safe_load(f)
+        # Read in one call; the bytes go straight to libyaml, which does its
+        # own decoding
+        try:
+            with open(self.config_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError as e:
+            raise FileNotFoundError(f"Config file not found: {self.config_path}") from e
+        yaml, loader, _ = yaml_codecs()
+        config_dict = yaml.load(data, Loader=loader)
         
         # Validate and convert to dataclass objects
-        paths = PathsConfig(**config_dict['paths'])
-        csv_files = CSVFilesConfig(**config_dict['csv_files'])
-        processing = ProcessingConfig(**config_dict['processing'])
-        session = SessionConfig(**config_dict['logging']['session'])
-        logging = LoggingConfig(
-            level=config_dict['logging']['level'],
-            file=config_dict['logging']['file'],
-            session=session
-        )
-        
-        self.config = Config(
-            paths=paths,
-            csv_files=csv_files,
-            processing=processing,
-            logging=logging
-        )
-        
+        self.config = config_from_dict(config_dict)
         return self.config
     
     def get_config(self) -> Config:
@@ -94,39 +161,37 @@ class ConfigManager:
         if self.config is None:
             self.load_config()
         
-        # Recursively update nested dictionaries
-        def update_dict(d: Dict[str, Any], u: Dict[str, Any]) -> Dict[str, Any]:
+        # Convert config to dict, update, and convert back
+        config_dict = asdict(self.config)
+        
+        # Merge nested dictionaries in place, one level per stack entry
+        stack = [(config_dict, updates)]
+        while stack:
+            d, u = stack.pop()
             for k, v in u.items():
-                if isinstance(v, dict):
-                    d[k] = update_dict(d.get(k, {}), v)
+                if isinstance(v, dict) and isinstance(d.get(k), dict):
+                    stack.append((d[k], v))
                 else:
                     d[k] = v
-            return d
         
-        # Convert config to dict, update, and convert back
-        config_dict = self.config.__dict__
-        updated_dict = update_dict(config_dict, updates)
-        self.config = Config(**updated_dict)
+        self.config = config_from_dict(config_dict)
     
     def save_config(self) -> None:
         """Save current configuration back to YAML file."""
         if self.config is None:
             raise ValueError("No configuration loaded")
         
-        def dataclass_to_dict(dc) -> Dict[str, Any]:
-            result = {}
-            for field in dc.__dataclass_fields__:
-                value = getattr(dc, field)
-                if hasattr(value, '__dataclass_fields__'):
-                    result[field] = dataclass_to_dict(value)
-                else:
-                    result[field] = value
-            return result
-        
-        config_dict = dataclass_to_dict(self.config)
+        config_dict = asdict(self.config)
         
+        # Render first, then write the whole document in one call
+        yaml, _, dumper = yaml_codecs()
+        data = yaml.dump(config_dict, Dumper=dumper, default_flow_style=False)
         with open(self.config_path, 'w') as f:
-            yaml.dump(config_dict, f, default_flow_style=False)
+            f.write(data)
+
+def get_config(config_path: str = "config.yaml") -> Config:
+    """Get the configuration for a config file from its shared ConfigManager."""
+    return ConfigManager(config_path).get_config()
 
 # Create a global config instance
-config = ConfigManager() 
\ No newline at end of file
+config = ConfigManager()
@@ -1,62 +1,147 @@
 #!/usr/bin/env python3
 # logging.py
 
+import os
 import sys
+import atexit
+import queue
 import logging
-from pathlib import Path
-from typing import Optional
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
 from .config import Config
 
+# Every module in the package logs through a child of this logger
+PACKAGE_LOGGER = __name__.split('.')[0]
+
+# Shared by every handler setup_logging creates
+LOG_FORMATTER = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+
+# Background listeners that own the file/console handlers, keyed by logger name
+_listeners: Dict[str, QueueListener] = {}
+
+# (log_dir, log file) each running listener was set up for, keyed by logger name
+_configured: Dict[str, Tuple[str, str]] = {}
+
+class BufferedFileHandler(logging.FileHandler):
+    """
+    FileHandler that writes through a large stream buffer.
+    
+    StreamHandler flushes after every record, costing a write() each; this
+    only flushes for WARNING and above, when the buffer fills and on close.
+    """
+    
+    def __init__(self, filename: str, mode: str = "a", buffer_size: int = 1 << 16):
+        self.buffer_size = buffer_size
+        super().__init__(filename, mode=mode)
+    
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.buffer_size,
+                    encoding=self.encoding, errors=self.errors)
+    
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.stream is None:
+            self.stream = self._open()
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= logging.WARNING:
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+def stop_logging(logger_name: Optional[str] = None) -> None:
+    """
+    Stop the background listener for a logger, flushing any queued records.
+    
+    Parameters:
+    logger_name (Optional[str]): Name passed to setup_logging. If None, uses the package logger.
+    """
+    _configured.pop(logger_name or PACKAGE_LOGGER, None)
+    listener = _listeners.pop(logger_name or PACKAGE_LOGGER, None)
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
 def setup_logging(config: Config, logger_name: Optional[str] = None) -> logging.Logger:
     """
     Set up logging with console and file handlers based on configuration.
     
+    Records are put on a queue by the calling thread and written to the
+    handlers by a background QueueListener, keeping file I/O out of the
+    processing loops. The listener is stopped at interpreter exit, or
+    explicitly with stop_logging(). Calling this again for the same logger
+    and log file returns the running logger unchanged, so a later stage in
+    the same process does not truncate the log.
+    
     Parameters:
     config (Config): Configuration object containing logging settings
-    logger_name (Optional[str]): Name of the logger to set up. If None, uses the caller's name.
+    logger_name (Optional[str]): Name of the logger to set up. If None, uses the package logger,
+        which every module logger in dicom2bids propagates to.
     
     Returns:
     logging.Logger: Configured logger instance
     """
+    logger_name = logger_name or PACKAGE_LOGGER
+    key = (config.paths.log_dir, config.logging.file)
+    if _configured.get(logger_name) == key:
+        return logging.getLogger(logger_name)
+    stop_logging(logger_name)
+    
     # Get the logger
-    logger = logging.getLogger(logger_name or __name__)
-    logger.setLevel(logging.DEBUG)  # gather all logs at DEBUG level internally
+    logger = logging.getLogger(logger_name)
+    # No handler below records anything under INFO, so don't create DEBUG records
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
     
-    # Remove any existing handlers to avoid duplicates
-    logger.handlers = []
+    # Remove (and close) any existing handlers to avoid duplicates
+    for handler in logger.handlers[:]:
+        handler.close()
+    logger.handlers.clear()
     
     # Console handler for WARNING and ERROR: show on stderr
     warning_handler = logging.StreamHandler(sys.stderr)
     warning_handler.setLevel(logging.WARNING)
-    warning_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-    warning_handler.setFormatter(warning_formatter)
-    logger.addHandler(warning_handler)
+    warning_handler.setFormatter(LOG_FORMATTER)
     
     # Console handler for CRITICAL: show on stdout
     critical_handler = logging.StreamHandler(sys.stdout)
     critical_handler.setLevel(logging.CRITICAL)
-    critical_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-    critical_handler.setFormatter(critical_formatter)
-    logger.addHandler(critical_handler)
+    critical_handler.setFormatter(LOG_FORMATTER)
     
     # File handler: record INFO+ to configured log file
-    log_file = str(Path(config.paths.log_dir) / config.logging.file)
-    file_handler = logging.FileHandler(log_file, mode="w")
+    log_dir = config.paths.log_dir
+    log_file = os.path.join(log_dir, config.logging.file)
+    file_handler = BufferedFileHandler(log_file, mode="w")
     file_handler.setLevel(logging.INFO)
-    file_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-    file_handler.setFormatter(file_formatter)
-    logger.addHandler(file_handler)
+    file_handler.setFormatter(LOG_FORMATTER)
     
     # Warning handler: record WARNING+ to error log
-    error_log = str(Path(config.paths.log_dir) / f"{Path(config.logging.file).stem}.err")
+    log_stem = os.path.splitext(os.path.basename(config.logging.file))[0]
+    error_log = os.path.join(log_dir, f"{log_stem}.err")
     error_handler = logging.FileHandler(error_log, mode="w")
     error_handler.setLevel(logging.WARNING)
-    error_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-    error_handler.setFormatter(error_formatter)
-    logger.addHandler(error_handler)
+    error_handler.setFormatter(LOG_FORMATTER)
+    
+    # Hand the handlers to a background listener; the logger only enqueues
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, warning_handler, critical_handler,
+                             file_handler, error_handler, respect_handler_level=True)
+    listener.start()
+    _listeners[logger_name] = listener
+    _configured[logger_name] = key
+    logger.addHandler(QueueHandler(log_queue))
     
     return logger
 
+def _stop_all_listeners() -> None:
+    """Flush and stop every background listener at interpreter exit."""
+    for logger_name in list(_listeners):
+        stop_logging(logger_name)
+
+atexit.register(_stop_all_listeners)
+
 def setup_excluded_scans_logger(config: Config) -> logging.Logger:
     """
     Set up a special logger for excluded scans.
@@ -67,13 +152,19 @@ def setup_excluded_scans_logger(config: Config) -> logging.Logger:
     Returns:
     logging.Logger: Configured logger instance for excluded scans
     """
-    excluded_scans_log = str(Path(config.paths.log_dir) / "excluded_scans.log")
+    excluded_scans_log = os.path.join(config.paths.log_dir, "excluded_scans.log")
     excluded_scans_logger = logging.getLogger('excluded_scans')
-    excluded_scans_logger.handlers = []  # Remove any existing handlers
+    # Remove any existing handlers, closing them so buffered records are written
+    for handler in excluded_scans_logger.handlers[:]:
+        handler.close()
+    excluded_scans_logger.handlers.clear()
     
-    excluded_scans_handler = logging.FileHandler(excluded_scans_log)
+    # Appends through a large buffer; flushed when full and at exit
+    excluded_scans_handler = BufferedFileHandler(excluded_scans_log)
     excluded_scans_handler.setFormatter(logging.Formatter('%(message)s'))
     excluded_scans_logger.addHandler(excluded_scans_handler)
     excluded_scans_logger.setLevel(logging.INFO)
+    # The reports belong in their own file, not on the root logger's console
+    excluded_scans_logger.propagate = False
     
     return excluded_scans_logger 
\ No newline at end of file
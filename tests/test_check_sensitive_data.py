@@ -0,0 +1,69 @@
+import pytest
+
+from dicom2bids import check_sensitive_data as csd
+
+
+def findings_for(path, terms):
+    return csd.check_sensitive_info(str(path), csd.build_term_matcher(terms))
+
+
+@pytest.fixture(params=["ijson", "json"])
+def parser(request, monkeypatch):
+    """Run a test once with ijson (when installed) and once with json.load."""
+    if request.param == "ijson":
+        if csd.ijson is None:
+            pytest.skip("ijson not installed")
+    else:
+        monkeypatch.setattr(csd, "ijson", None)
+    return request.param
+
+
+def test_report_values_for_numbers_and_lists(tmp_path, parser):
+    path = tmp_path / "sub-01_T2w.json"
+    path.write_text('{"age": 1.5, "dob": [1.5, 2, "x"], "name": {"n": 1e2}, "EchoTime": 0.1}')
+
+    assert findings_for(path, ["age", "dob", "name"]) == [
+        f"\nFound sensitive term 'age' in {path}", "Key: age", "Value: 1.5",
+        f"\nFound sensitive term 'dob' in {path}", "Key: dob", "Value: [1.5, 2, 'x']",
+        f"\nFound sensitive term 'name' in {path}", "Key: name", "Value: {'n': 100.0}",
+    ]
+
+
+def test_report_matches_json_load_for_duplicate_keys(tmp_path, parser):
+    path = tmp_path / "dup.json"
+    path.write_text('{"age": 1, "age": 2}')
+
+    assert findings_for(path, ["age"]) == [
+        f"\nFound sensitive term 'age' in {path}", "Key: age", "Value: 2",
+    ]
+
+
+@pytest.mark.parametrize("content", ['{bad', '{"age": 1, bad', '[1, 2]'])
+def test_invalid_documents_are_reported_once(tmp_path, parser, content):
+    path = tmp_path / "bad.json"
+    path.write_text(content)
+
+    findings = findings_for(path, ["age"])
+
+    assert len(findings) == 1
+    assert findings[0].startswith(f"\nError processing {path}: ")
+
+
+@pytest.mark.parametrize("key, expected", [
+    ("first name", ["first name", "name"]),
+    ("PatientName", []),
+    ("patient_name", ["patient", "name"]),
+    ("Name, first name", ["name", "first name"]),
+    ("subject_id", ["subject"]),
+    ("EchoTime", []),
+])
+def test_term_matcher_backends_agree(monkeypatch, key, expected):
+    terms = ["first name", "name", "patient", "subject"]
+    matchers = {}
+    if csd.ahocorasick is not None:
+        matchers["ahocorasick"] = csd.build_term_matcher(terms)
+    monkeypatch.setattr(csd, "ahocorasick", None)
+    matchers["regex"] = csd.build_term_matcher(terms)
+
+    for backend, match_terms in matchers.items():
+        assert match_terms(key) == expected, backend
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+from dicom2bids import convert_and_organize as cao
+
+
+def touch_dcm(folder, count=1):
+    folder.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        (folder / f"{i}.dcm").touch()
+
+
+def test_find_dcm_dirs_only_prunes_bids_output_folders(tmp_path):
+    subject = tmp_path / "MOMMAR_01_M"
+    touch_dcm(subject / "DICOM" / "dwi", 2)
+    touch_dcm(subject / "DICOM" / "series" / "anat")
+    touch_dcm(subject / "ses-01" / "dwi")
+    touch_dcm(subject / "ses-01" / "anat" / "T1")
+
+    found = {path.relative_to(subject).as_posix(): count
+             for path, count in cao.find_dcm_dirs(subject)}
+
+    assert found == {"DICOM/dwi": 2, "DICOM/series/anat": 1}
+
+
+def test_link_or_copy_replaces_existing_destinations(tmp_path):
+    src = tmp_path / "src.dcm"
+    src.write_bytes(b"x" * 5000)
+    other = tmp_path / "other.dcm"
+    other.write_bytes(b"y")
+    dangling = tmp_path / "dangling.dcm"
+    dangling.symlink_to(tmp_path / "missing.dcm")
+    symlink = tmp_path / "symlink.dcm"
+    symlink.symlink_to(src)
+    linked = tmp_path / "linked.dcm"
+    cao.link_or_copy(str(src), str(linked))
+
+    for dst in (dangling, symlink, linked, other):
+        cao.link_or_copy(str(src), str(dst))
+
+        assert not dst.is_symlink()
+        assert dst.stat().st_ino == src.stat().st_ino
+    assert src.read_bytes() == b"x" * 5000
+    assert other.read_bytes() == b"x" * 5000
+
+
+def test_stages_list_subjects_with_the_configured_prefix(tmp_path):
+    config = SimpleNamespace(paths=SimpleNamespace(subject_prefix="MOMMAR"))
+    (tmp_path / "MOMMAR_01_M").mkdir()
+    (tmp_path / "sourcedata").mkdir()
+
+    cao.generate_bids_structure(tmp_path, config)
+    cao.sort_files(tmp_path, config)
+
+    assert (tmp_path / "MOMMAR_01_M" / "ses-01" / "dwi").is_dir()
+    assert list((tmp_path / "sourcedata").iterdir()) == []
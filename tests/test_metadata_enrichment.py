@@ -0,0 +1,6 @@
+from dicom2bids.metadata_enrichment import index_scan_dirs
+
+
+def test_index_scan_dirs_of_missing_bids_dir_is_empty(tmp_path, caplog):
+    assert index_scan_dirs(str(tmp_path / "missing")) == set()
+    assert "BIDS directory not found" in caplog.text
@@ -0,0 +1,43 @@
+import io
+
+import pandas as pd
+
+from dicom2bids.nifti_calculations import assign_metadata_columns
+
+ROWS = [{"image_extent1": 64, "image_extent4": 3}, {"image_extent1": 64}]
+
+
+def per_cell_baseline(df):
+    """The per-cell df.at writes assign_metadata_columns replaced."""
+    for idx, metadata in zip(df.index, ROWS):
+        for key, value in metadata.items():
+            if key not in df.columns:
+                df[key] = None
+            df.at[idx, key] = value
+    return df
+
+
+def test_new_columns_match_per_cell_writes():
+    def frame():
+        return pd.DataFrame({"image_file": ["b4.nii.gz", "a3.nii.gz"]})
+
+    expected = per_cell_baseline(frame())
+    df = assign_metadata_columns(frame(), frame().index, ROWS)
+
+    assert df.dtypes.to_dict() == expected.dtypes.to_dict()
+    assert df.to_csv(index=False) == expected.to_csv(index=False)
+
+
+def test_existing_columns_keep_their_dtype():
+    # A re-run reads the columns back from the CSV, where an empty
+    # image_extent4 becomes float64
+    def frame():
+        return pd.read_csv(io.StringIO("image_file,image_extent4\nb4.nii.gz,\na3.nii.gz,\n"))
+
+    expected = per_cell_baseline(frame())
+    df = assign_metadata_columns(frame(), frame().index, ROWS)
+
+    assert df["image_extent4"].dtype == "float64"
+    assert df.dtypes.to_dict() == expected.dtypes.to_dict()
+    assert df.to_csv(index=False) == expected.to_csv(index=False)
+    assert df.to_csv(index=False).splitlines()[1] == "b4.nii.gz,3.0,64"